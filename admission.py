@@ -0,0 +1,141 @@
+"""
+Priority admission control for the analysis path.
+
+At most `capacity` analyses run at once per worker process. Callers beyond
+that wait in one bounded queue per priority class, and a freed slot always
+goes to the oldest waiter of the highest class (admin > premium > free >
+guest). Classes with a latency SLO are shed with Overloaded, which the app
+turns into 503 + Retry-After:
+
+- straight away, if their queue is full or the expected wait (queue ahead
+  of them x recent slot hold time / capacity) already exceeds the SLO;
+- or when they have waited for the SLO without getting a slot.
+
+Classes without an SLO only queue (up to their bound, and for at most
+max_wait), so paying users keep predictable latency while free and guest
+traffic absorbs a spike.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ADMIN, PREMIUM, FREE, GUEST = 'admin', 'premium', 'free', 'guest'
+PRIORITIES = (ADMIN, PREMIUM, FREE, GUEST)
+
+
+class Overloaded(Exception):
+    """An analysis was shed to protect higher-priority latency; try again later"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """Slots handed out in priority order, with per-class queue bounds and SLOs"""
+
+    def __init__(self, capacity, queue_limits, slos, max_wait=None, initial_service_time=5.0):
+        self.capacity = capacity
+        self.queue_limits = queue_limits
+        self.slos = slos
+        self.max_wait = max_wait
+        self.service_time = initial_service_time
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.shed = {priority: 0 for priority in PRIORITIES}
+        self.waited = {priority: 0.0 for priority in PRIORITIES}
+
+    def acquire(self, priority):
+        """Wait for a slot; returns a release callable, or raises Overloaded"""
+        start = time.monotonic()
+        slo = self.slos.get(priority)
+
+        with self._lock:
+            if self._active < self.capacity and not any(self._queues.values()):
+                self._active += 1
+                self.admitted[priority] += 1
+                return self._releaser(start)
+
+            queue = self._queues[priority]
+            if len(queue) >= self.queue_limits[priority]:
+                raise self._shed(priority)
+            if slo is not None and self._expected_wait(priority) > slo:
+                raise self._shed(priority)
+            waiter = Waiter()
+            queue.append(waiter)
+
+        waiter.event.wait(slo if slo is not None else self.max_wait)
+
+        with self._lock:
+            if not waiter.granted:
+                queue.remove(waiter)
+                raise self._shed(priority)
+            self.admitted[priority] += 1
+            self.waited[priority] += time.monotonic() - start
+        return self._releaser(time.monotonic())
+
+    @contextmanager
+    def slot(self, priority):
+        release = self.acquire(priority)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active,
+                'service_time': self.service_time,
+                'queued': {priority: len(queue) for priority, queue in self._queues.items()},
+                'admitted': dict(self.admitted),
+                'shed': dict(self.shed),
+                'waited': dict(self.waited),
+            }
+
+    def _releaser(self, started):
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            self._release(time.monotonic() - started)
+        return release
+
+    def _release(self, held):
+        with self._lock:
+            # Recent slot hold time, for expected-wait estimates
+            self.service_time += 0.2 * (held - self.service_time)
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                if queue:
+                    # Hand the slot straight to the next waiter
+                    waiter = queue.popleft()
+                    waiter.granted = True
+                    waiter.event.set()
+                    return
+            self._active -= 1
+
+    def _shed(self, priority):
+        self.shed[priority] += 1
+        wait = max(1, math.ceil(self._expected_wait(priority)))
+        return Overloaded(f"The server is busy right now, please try again in {wait}s", wait)
+
+    def _expected_wait(self, priority):
+        ahead = sum(len(self._queues[p]) for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return (ahead + 1) * self.service_time / self.capacity
@@ -0,0 +1,71 @@
+"""
+Incremental parsing of streamed SCORE/ANALYSIS completions for SSE output.
+"""
+
+import json
+import re
+
+SCORE_RE = re.compile(r'SCORE:\s*(\d{1,3})\D')
+SCORE_A_RE = re.compile(r'SCORE_A:\s*(\d{1,3})\D')
+SCORE_B_RE = re.compile(r'SCORE_B:\s*(\d{1,3})\D')
+ANALYSIS_MARKER = 'ANALYSIS:'
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _clamp(value):
+    return max(0, min(100, int(value)))
+
+
+class StreamingScoreParser:
+    """Turn text deltas into `score` and `analysis` events as they become known"""
+
+    def __init__(self, battle=False):
+        self.battle = battle
+        self.text = ''
+        self.score_sent = False
+        self._analysis_start = None
+        self._analysis_sent = 0
+
+    def feed(self, delta):
+        """Add a chunk of completion text and return any new (event, data) pairs"""
+        self.text += delta
+        events = []
+
+        if not self.score_sent:
+            score = self._find_score()
+            if score is not None:
+                self.score_sent = True
+                events.append(('score', score))
+
+        if self._analysis_start is None:
+            index = self.text.find(ANALYSIS_MARKER)
+            if index != -1:
+                self._analysis_start = index + len(ANALYSIS_MARKER)
+                self._analysis_sent = self._analysis_start
+
+        if self._analysis_start is not None:
+            chunk = self.text[self._analysis_sent:]
+            if self._analysis_sent == self._analysis_start:
+                chunk = chunk.lstrip()
+            if chunk:
+                self._analysis_sent = len(self.text)
+                events.append(('analysis', {'text': chunk}))
+
+        return events
+
+    def _find_score(self):
+        if self.battle:
+            match_a = SCORE_A_RE.search(self.text)
+            match_b = SCORE_B_RE.search(self.text)
+            if match_a and match_b:
+                return {'scoreA': _clamp(match_a.group(1)), 'scoreB': _clamp(match_b.group(1))}
+            return None
+
+        match = SCORE_RE.search(self.text)
+        if match:
+            return {'score': _clamp(match.group(1))}
+        return None
@@ -3,26 +3,85 @@ TasteCheck Backend Server - Flask Version
 Handles image analysis using Claude's vision API
 """
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Request, request, jsonify, abort, Response, stream_with_context, g
 import anthropic
+import openai
 from openai import OpenAI
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
-from models import db, User
-from rate_limit import check_guest_limit, increment_guest_usage
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db, User, configure_sqlite, ensure_indexes, user_cache
+from rate_limit import check_guest_limit, increment_guest_usage, try_guest_usage, release_guest_usage
+from result_cache import ResultCache, make_key
+from analysis_stream import StreamingScoreParser, sse_event
+from image_prep import normalize_image
+from assets import AssetPipeline
+from extraction import EXTRACT_PROMPT, EXTRACT_VERSION, ExtractionError, parse_extraction, format_record
+from metrics import Metrics, BYTES_BUCKETS
+from routing import Router, load_overrides
+from single_flight import SingleFlight
+from jobs import JobStore, JobQueue, DONE, ERROR
+from upstream import CircuitOpen, Gateway, UpstreamUnavailable
+from podcast_script import segment_script
+from audio_assembly import Mp3Assembler, COMPACT_FORMATS, can_transcode, transcode
+from speech_cache import SpeechCache, normalize_text, segment_key
+from admission import AdmissionController, Overloaded, ADMIN, PREMIUM, FREE, GUEST, PRIORITIES
 
 import os
+import json
+import time
 import base64
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 # Configuration
 API_KEY = os.environ.get('ANTHROPIC_API_KEY', '')
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='.', static_url_path='')
+# Model, max_tokens and timeout per mode/style (see routing.py)
+router = Router(load_overrides(os.environ.get('MODEL_ROUTES')))
+
+# Styles the render prompts know; anything else is treated as analytical
+STYLES = ('analytical', 'roasting', 'encouraging', 'sarcastic', 'podcast')
+
+# Screenshots are downscaled and re-encoded before they go to the vision model
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', 1568))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG')
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 82))
+
+# Uploaded screenshots larger than this are spooled to a temp file
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 1024 * 1024))
+
+
+class UploadRequest(Request):
+    """Request that spools multipart file fields to disk past UPLOAD_SPOOL_THRESHOLD"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, mode='rb+')
+
+
+# Initialize Flask app (static files are served from the asset pipeline below)
+app = Flask(__name__, static_folder=None, instance_path=os.environ.get('TASTECHECK_INSTANCE_PATH'))
+app.request_class = UploadRequest
+
+# Number of reverse proxies in front of the app. Only the X-Forwarded-For
+# hops they appended are trusted, so clients can't pick their own IP (and
+# with it a fresh guest quota). Render (which sets RENDER) runs one proxy.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1 if os.environ.get('RENDER') else 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///tastecheck.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///tastecheck.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# One pooled connection per request thread in each gunicorn worker
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 8)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 8)),
+    'pool_timeout': 10,
+}
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 # Initialize extensions
@@ -31,118 +90,1028 @@ bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+user_cache.ttl = int(os.environ.get('USER_CACHE_TTL', 30))
+
+# Metrics (off unless METRICS_ENABLED is set; served on /metrics)
+metrics = Metrics(
+    enabled=os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes'),
+    directory=os.path.join(app.instance_path, 'metrics'),
+    flush_interval=int(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+)
+REQUEST_SECONDS = metrics.histogram(
+    'tastecheck_request_seconds', 'Request latency, including streamed bodies', ('endpoint', 'method', 'status'))
+REQUEST_BYTES = metrics.histogram(
+    'tastecheck_request_bytes', 'Request body size', ('endpoint',), BYTES_BUCKETS)
+RESPONSE_BYTES = metrics.histogram(
+    'tastecheck_response_bytes', 'Response body size', ('endpoint',), BYTES_BUCKETS)
+IN_FLIGHT = metrics.gauge(
+    'tastecheck_requests_in_flight', 'Requests currently being handled', ('endpoint',))
+STAGE_SECONDS = metrics.histogram(
+    'tastecheck_stage_seconds', 'Time spent in each stage of a request', ('stage',))
+UPSTREAM_SECONDS = metrics.histogram(
+    'tastecheck_upstream_seconds', 'Upstream API call latency', ('call', 'mode', 'style', 'model'))
+UPSTREAM_TOKENS = metrics.counter(
+    'tastecheck_upstream_tokens_total', 'Tokens reported in message.usage',
+    ('call', 'mode', 'style', 'model', 'kind'))
+ROUTE_CALLS = metrics.counter(
+    'tastecheck_route_calls_total', 'Upstream calls by route, model and outcome', ('route', 'model', 'outcome'))
+COALESCED = metrics.counter(
+    'tastecheck_coalesced_total', 'Calls served by joining an identical call already in flight', ('kind',))
+GATEWAY_EVENTS = metrics.counter(
+    'tastecheck_upstream_gateway_total', 'Upstream gateway calls, retries, failures, fast rejections and breaker trips',
+    ('provider', 'event'))
+GATEWAY_IN_FLIGHT = metrics.gauge(
+    'tastecheck_upstream_in_flight', 'Upstream calls holding a gateway slot', ('provider',))
+BREAKER_OPEN = metrics.gauge(
+    'tastecheck_upstream_breaker_open', 'Per-model circuit breakers open or half-open, summed over workers',
+    ('provider',))
+ADMISSIONS = metrics.counter(
+    'tastecheck_admission_total', 'Analyses admitted or shed, by priority class', ('priority', 'outcome'))
+ADMISSION_WAIT = metrics.counter(
+    'tastecheck_admission_wait_seconds_total', 'Time admitted analyses spent queued for a slot', ('priority',))
+ADMISSION_QUEUED = metrics.gauge(
+    'tastecheck_admission_queued', 'Analyses waiting for a slot', ('priority',))
+CACHE_LOOKUPS = metrics.counter(
+    'tastecheck_cache_lookups_total', 'Cache lookups by outcome', ('cache', 'result'))
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    with metrics.stage(STAGE_SECONDS, 'load_user'):
+        return user_cache.load(int(user_id))
 
 # Create tables
 with app.app_context():
+    configure_sqlite(db.engine)
     db.create_all()
+    ensure_indexes()
+
+
+# Analysis result cache (SQLite file lives next to tastecheck.db)
+result_cache = ResultCache(
+    os.path.join(app.instance_path, 'analysis_cache.db'),
+    memory_size=int(os.environ.get('ANALYSIS_CACHE_MEMORY_SIZE', 256)),
+    ttl=int(os.environ.get('ANALYSIS_CACHE_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 5000)),
+)
+
+# Per-screenshot extraction records, keyed by image content only
+extraction_cache = ResultCache(
+    os.path.join(app.instance_path, 'extraction_cache.db'),
+    memory_size=int(os.environ.get('EXTRACTION_CACHE_MEMORY_SIZE', 512)),
+    ttl=int(os.environ.get('EXTRACTION_CACHE_TTL', 30 * 24 * 3600)),
+    max_entries=int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', 20000)),
+)
+
+
+def collect_cache_stats():
+    for name, cache in (('analysis', result_cache), ('extraction', extraction_cache)):
+        stats = cache.stats()
+        for result in ('hits_memory', 'hits_disk', 'misses'):
+            CACHE_LOOKUPS.set(stats[result], name, result)
+    stats = speech_cache.stats()
+    CACHE_LOOKUPS.set(stats['hits'], 'speech', 'hits_disk')
+    CACHE_LOOKUPS.set(stats['misses'], 'speech', 'misses')
+
+metrics.add_collector(collect_cache_stats)
+
+
+def collect_gateway_stats():
+    for gateway in (anthropic_gateway, openai_gateway):
+        stats = gateway.stats()
+        for event in ('calls', 'retries', 'failures', 'rejected', 'trips'):
+            GATEWAY_EVENTS.set(stats[event], gateway.name, event)
+        GATEWAY_IN_FLIGHT.set(stats['in_flight'], gateway.name)
+        BREAKER_OPEN.set(gateway.open_breakers(), gateway.name)
+
+metrics.add_collector(collect_gateway_stats)
+
+
+def collect_admission_stats():
+    stats = admission.stats()
+    for priority in PRIORITIES:
+        ADMISSIONS.set(stats['admitted'][priority], priority, 'admitted')
+        ADMISSIONS.set(stats['shed'][priority], priority, 'shed')
+        ADMISSION_WAIT.set(stats['waited'][priority], priority)
+        ADMISSION_QUEUED.set(stats['queued'][priority], priority)
+
+metrics.add_collector(collect_admission_stats)
+
+
+# Identical concurrent analyses / dialogues / TTS lines share one upstream call
+analysis_flights = SingleFlight()
+audio_flights = SingleFlight()
+speech_flights = SingleFlight()
+
+
+def describe_analysis_error(e):
+    """The JSON body /analyze returns for an exception (also stored on failed jobs)"""
+    if isinstance(e, ExtractionError):
+        return {"error": str(e), "failed_images": sorted(e.failures)}
+    if isinstance(e, (UpstreamUnavailable, Overloaded)):
+        return {"error": str(e), "retry_after": e.retry_after}
+    return {"error": str(e)}
+
+
+def unavailable_response(e):
+    """503 with Retry-After while an upstream provider is degraded or load is being shed"""
+    print(f"Unavailable: {e}")
+    return jsonify(describe_analysis_error(e)), 503, {'Retry-After': str(e.retry_after)}
+
+
+# Background analysis jobs (POST /analyze?async=1), shared state in SQLite
+job_queue = JobQueue(
+    JobStore(os.path.join(app.instance_path, 'jobs.db'), ttl=int(os.environ.get('JOB_TTL', 24 * 3600))),
+    workers=int(os.environ.get('JOB_WORKERS', 4)),
+    max_pending=int(os.environ.get('JOB_QUEUE_LIMIT', 64)),
+    context=app.app_context,
+    describe_error=describe_analysis_error,
+)
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+# Longest a /jobs/<id>/events stream stays open; clients reconnect after that
+JOB_EVENTS_TIMEOUT = float(os.environ.get('JOB_EVENTS_TIMEOUT', 600))
+
+# Analyses running at once per worker; when saturated, admins then premium
+# then free users then guests get the next slot. Free and guest requests are
+# shed with 503 + Retry-After rather than wait past their latency SLO;
+# admins and premium users wait up to ADMISSION_MAX_WAIT.
+admission = AdmissionController(
+    capacity=int(os.environ.get('ADMISSION_CAPACITY', 8)),
+    queue_limits={
+        priority: int(os.environ.get(f'ADMISSION_QUEUE_{priority.upper()}', limit))
+        for priority, limit in ((ADMIN, 64), (PREMIUM, 64), (FREE, 32), (GUEST, 16))
+    },
+    slos={
+        FREE: float(os.environ.get('ADMISSION_SLO_FREE', 30)),
+        GUEST: float(os.environ.get('ADMISSION_SLO_GUEST', 15)),
+    },
+    max_wait=float(os.environ.get('ADMISSION_MAX_WAIT', 300)),
+)
+
+
+# Hashed, precompressed front-end assets
+assets = AssetPipeline(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Initialize Anthropic client (retries are done by the gateways below, not the SDKs)
+client = anthropic.Anthropic(api_key=API_KEY, max_retries=0)
+openai_client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY', ''), max_retries=0)
+
+# Concurrency cap, backoff and circuit breaker per provider (see upstream.py)
+anthropic_gateway = Gateway(
+    'Claude',
+    concurrency=int(os.environ.get('ANTHROPIC_CONCURRENCY', 16)),
+    max_retries=int(os.environ.get('UPSTREAM_RETRIES', 3)),
+    failure_threshold=int(os.environ.get('BREAKER_THRESHOLD', 5)),
+    cooldown=float(os.environ.get('BREAKER_COOLDOWN', 30)),
+    connection_errors=(anthropic.APIConnectionError,),
+    timeout_errors=(anthropic.APITimeoutError,),
+)
+
+# Screenshots of a multi-image analysis are read concurrently on this pool.
+# It lives as long as the worker, so its threads (and their extraction cache
+# connections) are reused across requests.
+extract_pool = ThreadPoolExecutor(
+    max_workers=max(1, int(os.environ.get('EXTRACT_CONCURRENCY', 8))), thread_name_prefix='extract')
+
+
+# Podcast host -> OpenAI TTS voice
+PODCAST_VOICES = {
+    'ALEX:': 'onyx',  # Male voice for Alex
+    'JORDAN:': 'nova',  # Female voice for Jordan
+}
+TTS_CONCURRENCY = int(os.environ.get('TTS_CONCURRENCY', 6))
+TTS_RETRIES = int(os.environ.get('TTS_RETRIES', 2))
+TTS_TIMEOUT = float(os.environ.get('TTS_TIMEOUT', 30))
+# Long-lived pool shared by every podcast, so its threads (and their speech
+# cache connections) are reused instead of created per request
+tts_pool = ThreadPoolExecutor(max_workers=max(1, TTS_CONCURRENCY), thread_name_prefix='tts')
+TTS_MODEL = 'tts-1'
+# Seconds of silence between speakers in the stitched podcast (0 for none)
+PODCAST_PAUSE = float(os.environ.get('PODCAST_PAUSE', 0.25))
+
+# Synthesized lines, shared across podcasts and workers
+speech_cache = SpeechCache(
+    os.environ.get('SPEECH_CACHE_DIR', os.path.join(app.instance_path, 'speech_cache')),
+    max_bytes=int(os.environ.get('SPEECH_CACHE_MAX_BYTES', 512 * 1024 * 1024)),
+)
+
+openai_gateway = Gateway(
+    'Text-to-speech',
+    concurrency=int(os.environ.get('OPENAI_CONCURRENCY', 8)),
+    max_retries=TTS_RETRIES,
+    failure_threshold=int(os.environ.get('BREAKER_THRESHOLD', 5)),
+    cooldown=float(os.environ.get('BREAKER_COOLDOWN', 30)),
+    connection_errors=(openai.APIConnectionError,),
+    timeout_errors=(openai.APITimeoutError,),
+)
+
+
+def parse_podcast_script(dialogue_text):
+    """Split dialogue into an ordered list of (voice, text) TTS jobs, one per turn"""
+    return segment_script(dialogue_text, PODCAST_VOICES)
+
+
+def synthesize_segment(voice, text):
+    """Audio for one line: from the speech cache, an identical line in flight, or TTS"""
+    text = normalize_text(text)
+    key = segment_key(TTS_MODEL, voice, text)
+    audio = speech_cache.get(key)
+    if audio is not None:
+        return audio
+    
+    audio, leader = speech_flights.do(key, synthesize_and_store, key, voice, text)
+    if not leader:
+        COALESCED.inc(1, 'speech')
+    return audio
+
+
+def synthesize_and_store(key, voice, text):
+    audio = synthesize_line(voice, text)
+    speech_cache.put(key, audio)
+    return audio
+
+
+def synthesize_line(voice, text):
+    """Synthesize one line; the gateway retries just this line on failure"""
+    start = time.perf_counter()
+    response = openai_gateway.call(
+        lambda timeout: openai_client.audio.speech.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            timeout=timeout,
+        ),
+        TTS_TIMEOUT,
+    )
+    UPSTREAM_SECONDS.observe(time.perf_counter() - start, 'speech', 'podcast', '', TTS_MODEL)
+    return response.content
+
+
+def iter_podcast_audio(segments):
+    """Yield synthesized segments in script order.
+
+    At most TTS_CONCURRENCY lines are in flight or buffered at once, so a
+    streaming caller never holds more than that many segments in memory.
+    """
+    segments = iter(segments)
+    pending = deque(
+        tts_pool.submit(synthesize_segment, *seg) for seg in islice(segments, TTS_CONCURRENCY)
+    )
+    try:
+        while pending:
+            audio = pending.popleft().result()
+            seg = next(segments, None)
+            if seg is not None:
+                pending.append(tts_pool.submit(synthesize_segment, *seg))
+            yield audio
+    finally:
+        for future in pending:
+            future.cancel()
 
 
-# Initialize Anthropic client
-client = anthropic.Anthropic(api_key=API_KEY)
-openai_client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY', ''))
-
+def iter_podcast_frames(segments, assembler):
+    """Yield each segment's MP3 frames in script order, stitched by assembler"""
+    for (voice, _), audio in zip(segments, iter_podcast_audio(segments)):
+        yield assembler.add(voice, audio)
 
 
-def generate_podcast_audio(dialogue_text):
-    """Generate audio from podcast dialogue using OpenAI TTS"""
+def generate_podcast_audio(dialogue_text, audio_format='mp3'):
+    """Generate podcast audio with OpenAI TTS.
+    
+    Returns (audio bytes, mimetype, duration in seconds), or None. The
+    audio is one MP3 with a single Info header, or audio_format from
+    COMPACT_FORMATS when ffmpeg is available to re-encode it.
+    """
     try:
-        # Split dialogue into Alex and Jordan parts
-        lines = dialogue_text.strip().split('\n')
-        audio_segments = []
+        segments = parse_podcast_script(dialogue_text)
+        if not segments:
+            return None
         
-        for line in lines:
-            if line.startswith('ALEX:'):
-                text = line.replace('ALEX:', '').strip()
-                if text:
-                    response = openai_client.audio.speech.create(
-                        model="tts-1",
-                        voice="onyx",  # Male voice for Alex
-                        input=text
-                    )
-                    audio_segments.append(response.content)
-            elif line.startswith('JORDAN:'):
-                text = line.replace('JORDAN:', '').strip()
-                if text:
-                    response = openai_client.audio.speech.create(
-                        model="tts-1",
-                        voice="nova",  # Female voice for Jordan
-                        input=text
-                    )
-                    audio_segments.append(response.content)
+        assembler = Mp3Assembler(PODCAST_PAUSE)
+        frames = b''.join(iter_podcast_frames(segments, assembler))
+        if not frames:
+            return None
+        audio, mimetype = assembler.header() + frames, 'audio/mpeg'
         
-        # Combine audio segments
-        combined_audio = b''.join(audio_segments)
-        return combined_audio
+        if audio_format in COMPACT_FORMATS:
+            if can_transcode():
+                try:
+                    audio, mimetype = transcode(audio, audio_format)
+                except Exception as e:
+                    print(f"Audio transcode error, sending MP3: {e}")
+            else:
+                print(f"ffmpeg not installed, sending MP3 instead of {audio_format}")
+        return audio, mimetype, assembler.duration
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"Audio generation error: {e}")
         return None
 
+def metrics_endpoint():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request_metrics():
+    if not metrics.enabled:
+        return
+    metrics.start()
+    g.metrics_start = time.perf_counter()
+    g.metrics_status = 500
+    endpoint = metrics_endpoint()
+    IN_FLIGHT.inc(1, endpoint)
+    if request.content_length is not None:
+        REQUEST_BYTES.observe(request.content_length, endpoint)
+
+
+@app.after_request
+def record_response_metrics(response):
+    if not metrics.enabled or 'metrics_start' not in g:
+        return response
+    g.metrics_status = response.status_code
+    endpoint = metrics_endpoint()
+    if not response.is_streamed:
+        RESPONSE_BYTES.observe(response.calculate_content_length() or 0, endpoint)
+    else:
+        response.response = count_streamed_bytes(response.response, endpoint)
+    return response
+
+
+def count_streamed_bytes(body, endpoint):
+    sent = 0
+    try:
+        for chunk in body:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_BYTES.observe(sent, endpoint)
+        if hasattr(body, 'close'):
+            body.close()
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Runs after a streamed body has been fully sent
+    if not metrics.enabled or 'metrics_start' not in g:
+        return
+    endpoint = metrics_endpoint()
+    IN_FLIGHT.dec(1, endpoint)
+    REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, endpoint, request.method, g.metrics_status)
+
+
+@app.route('/metrics')
+def metrics_page():
+    """Prometheus scrape target (404 unless METRICS_ENABLED)"""
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     """Serve the main page"""
-    return send_from_directory('.', 'index.html')
+    return assets.respond(assets.lookup('index.html'), request)
 
 
 @app.route('/<path:path>')
 def serve_static(path):
     """Serve static files"""
-    return send_from_directory('.', path)
+    asset = assets.lookup(path)
+    if asset is None:
+        abort(404)
+    return assets.respond(asset, request)
 
 
 
 @app.route('/auth')
 def auth_page():
-    return send_file('auth.html')
+    return assets.respond(assets.lookup('auth.html'), request)
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    """Handle POST requests for image analysis"""
+    """Handle POST requests for image analysis.
+
+    With ?async=1 (or `Prefer: respond-async`) the analysis runs as a
+    background job: the response is 202 with a job id to poll at
+    /jobs/<id> or follow at /jobs/<id>/events. Results that are already
+    cached are returned directly either way.
+    """
     try:
-        data = request.get_json()
+        with metrics.stage(STAGE_SECONDS, 'decode'):
+            try:
+                data, image_bytes = read_analyze_request()
+                mode, style, images = analysis_inputs(data)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            if image_bytes is None:
+                image_bytes = [base64.b64decode(img) for img in images]
         
-        # Extract data
-        images = data.get('images', [])
-        style = data.get('style', 'analytical')
-        mode = data.get('mode', 'single')
+        # Identical inputs give identical results, so serve repeats from cache
+        with metrics.stage(STAGE_SECONDS, 'cache_lookup'):
+            cache_key = analysis_cache_key(data, image_bytes, mode, style)
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
         
-        # Backward compatibility: handle single image format
-        if not images and data.get('image'):
-            images = [data.get('image')]
+        # Concurrent duplicates (a viral battle link) wait for the first one's
+        # result; like a cache hit, that costs no quota
+        pending = analysis_flights.pending(cache_key)
+        release = None
+        if pending is None:
+            with metrics.stage(STAGE_SECONDS, 'quota'):
+                release = reserve_quota()
+            if release is None:
+                return jsonify({"error": "Daily analysis limit reached"}), 429
         
-        # Analyze based on mode
-        if mode == 'manual':
-            answers = data.get('answers', {})
-            userName = data.get('userName', '')
-            if not answers:
-                return jsonify({"error": "No answers provided"}), 400
-            result = analyze_manual_input(answers, style, userName)
-        elif mode == 'single':
-            if not images:
-                return jsonify({"error": "No images provided"}), 400
-            userName = data.get('userName', '')
-            result = analyze_music_taste(images[0], style, userName=userName)
-        elif mode == 'evolution':
-            if not images:
-                return jsonify({"error": "No images provided"}), 400
-            userName = data.get('userName', '')
-            result = analyze_evolution(images, style, userName=userName)
-        elif mode == 'battle':
-            if not images:
-                return jsonify({"error": "No images provided"}), 400
-            nameA = data.get('nameA', 'Person 1')
-            nameB = data.get('nameB', 'Person 2')
-            result = analyze_battle(images, style, nameA, nameB)
-        else:
-            return jsonify({"error": "Invalid mode"}), 400
+        priority = request_priority()
         
-        return jsonify(result)
+        def complete():
+            return complete_analysis(data, mode, style, image_bytes, cache_key, pending, release, priority)
         
+        # A duplicate of an analysis already in flight is answered directly:
+        # it only waits for that result, so there's nothing to hand off
+        if wants_job() and pending is None:
+            job_id = job_queue.submit(complete)
+            if job_id is None:
+                if release:
+                    release()
+                return jsonify({"error": "Too many analyses in progress, try again shortly"}), 503, {'Retry-After': '5'}
+            return jsonify({
+                "job_id": job_id,
+                "status_url": f"/jobs/{job_id}",
+                "events_url": f"/jobs/{job_id}/events",
+            }), 202, {'Location': f"/jobs/{job_id}"}
+        
+        return jsonify(complete())
+        
+    except ExtractionError as e:
+        print(f"Extraction error: {e}")
+        return jsonify(describe_analysis_error(e)), 502
+    except (UpstreamUnavailable, Overloaded) as e:
+        return unavailable_response(e)
     except Exception as e:
         print(f"Error: {e}")
-        return jsonify({"error": str(e)}), 500
+        return jsonify(describe_analysis_error(e)), 500
+
+
+def wants_job():
+    return (request.args.get('async') in ('1', 'true')
+            or 'respond-async' in request.headers.get('Prefer', ''))
+
+
+def complete_analysis(data, mode, style, image_bytes, cache_key, pending, release, priority):
+    """Run (or join) the analysis for cache_key, giving back the quota if it wasn't used"""
+    if pending is not None:
+        COALESCED.inc(1, 'analysis')
+        return pending.result()
+    
+    def compute():
+        fallbacks = fallback_count()
+        result = run_analysis(data, mode, style, image_bytes)
+        # The key names the route's primary model; don't store a fallback's answer under it
+        if not analysis_failed(result) and fallback_count() == fallbacks:
+            with metrics.stage(STAGE_SECONDS, 'cache_store'):
+                result_cache.put(cache_key, result)
+        return result
+    
+    try:
+        with metrics.stage(STAGE_SECONDS, 'admission'):
+            admit = admission.acquire(priority)
+        try:
+            result, leader = analysis_flights.do(cache_key, compute)
+        finally:
+            admit()
+    except Exception:
+        release()
+        raise
+    
+    # Lost the race to start the call, so this was a duplicate after all
+    if not leader:
+        COALESCED.inc(1, 'analysis')
+    if not leader or analysis_failed(result):
+        release()
+    return result
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status, progress stage and (when finished) result or error of an analysis job"""
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Follow a job as Server-Sent Events.
+
+    `progress` with {status, stage} whenever either changes, then `done`
+    with the analysis result or `error` with the same body /analyze would
+    have returned. After JOB_EVENTS_TIMEOUT the stream ends with an `error`
+    carrying the job's status; the job itself keeps running.
+    """
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    def generate(job):
+        last = None
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while True:
+            state = (job['status'], job['stage'])
+            if state != last:
+                yield sse_event('progress', {"status": job['status'], "stage": job['stage']})
+                last = state
+            if job['status'] == DONE:
+                yield sse_event('done', job['result'])
+                return
+            if job['status'] == ERROR:
+                yield sse_event('error', job['error'])
+                return
+            if time.monotonic() >= deadline:
+                yield sse_event('error', {
+                    "error": "Still working on it, check back shortly",
+                    "status": job['status'],
+                    "status_url": f"/jobs/{job_id}",
+                })
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+            job = job_queue.store.get(job_id)
+            if job is None:
+                yield sse_event('error', {"error": "Job not found"})
+                return
+    
+    return Response(
+        generate(job),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Same as /analyze, but streams the result as Server-Sent Events.
+
+    Events: `score` as soon as the score line arrives, `analysis` with each
+    new chunk of analysis text, then `done` with the same JSON /analyze
+    returns (or `error`).
+    """
+    with metrics.stage(STAGE_SECONDS, 'decode'):
+        try:
+            data, image_bytes = read_analyze_request()
+            mode, style, images = analysis_inputs(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        if image_bytes is None:
+            image_bytes = [base64.b64decode(img) for img in images]
+    
+    with metrics.stage(STAGE_SECONDS, 'cache_lookup'):
+        cache_key = analysis_cache_key(data, image_bytes, mode, style)
+        cached = result_cache.get(cache_key)
+    
+    pending = analysis_flights.pending(cache_key) if cached is None else None
+    
+    release = None
+    if cached is None and pending is None:
+        with metrics.stage(STAGE_SECONDS, 'quota'):
+            release = reserve_quota()
+        if release is None:
+            return jsonify({"error": "Daily analysis limit reached"}), 429
+        # Held until the response is closed, so for the whole stream
+        try:
+            with metrics.stage(STAGE_SECONDS, 'admission'):
+                admit = admission.acquire(request_priority())
+        except Overloaded as e:
+            release()
+            return unavailable_response(e)
+    
+    def generate():
+        if cached is not None:
+            yield sse_event('done', cached)
+            return
+        
+        future, leader = pending, False
+        if future is None:
+            future, leader = analysis_flights.begin(cache_key)
+            if not leader:
+                release()
+        if not leader:
+            COALESCED.inc(1, 'analysis')
+            try:
+                yield sse_event('done', future.result())
+            except Exception as e:
+                print(f"Stream error: {e}")
+                yield sse_event('error', describe_analysis_error(e))
+            return
+        
+        finished = False
+        try:
+            request_kwargs, parse = build_analysis_request(data, mode, style, image_bytes)
+            parser = StreamingScoreParser(battle=(mode == 'battle'))
+            
+            start = time.perf_counter()
+            first_token = None
+            fallbacks = fallback_count()
+            for text in stream_message('render', mode, style, **request_kwargs):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    STAGE_SECONDS.observe(first_token - start, 'first_token')
+                for event, payload in parser.feed(text):
+                    yield sse_event(event, payload)
+            
+            with metrics.stage(STAGE_SECONDS, 'parse'):
+                result = parse(parser.text)
+            if fallback_count() == fallbacks:
+                with metrics.stage(STAGE_SECONDS, 'cache_store'):
+                    result_cache.put(cache_key, result)
+            analysis_flights.finish(cache_key, result)
+            finished = True
+            yield sse_event('done', result)
+        except Exception as e:
+            print(f"Stream error: {e}")
+            release()
+            if not finished:
+                analysis_flights.finish(cache_key, error=e)
+                finished = True
+            yield sse_event('error', describe_analysis_error(e))
+        finally:
+            # The client went away mid-stream; don't leave duplicates waiting
+            if not finished:
+                analysis_flights.finish(cache_key, error=RuntimeError('Analysis was cancelled'))
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    if release is not None:
+        response.call_on_close(admit)
+    return response
+
+
+def read_analyze_request():
+    """Return the /analyze body as a dict, plus raw image bytes if they were uploaded.
+
+    JSON bodies carry base64 images as before. multipart/form-data bodies
+    carry the same fields as form values, `answers` as a JSON string and the
+    screenshots as `images` file fields, which are kept as raw bytes.
+    Malformed `answers` JSON raises ValueError.
+    """
+    if request.mimetype != 'multipart/form-data':
+        return request.get_json(), None
+    
+    data = request.form.to_dict()
+    if 'answers' in data:
+        try:
+            data['answers'] = json.loads(data['answers'])
+        except ValueError:
+            raise ValueError("Invalid answers") from None
+    
+    image_bytes = []
+    for upload in request.files.getlist('images'):
+        image_bytes.append(upload.read())
+        upload.close()
+    data['images'] = image_bytes
+    return data, image_bytes
+
+
+def analysis_inputs(data):
+    """Pull mode, style and images out of an /analyze body, or raise ValueError"""
+    images = data.get('images', [])
+    mode = data.get('mode', 'single')
+    
+    # Unknown styles get the analytical prompt anyway; mapping them here keeps
+    # arbitrary values out of metric labels, routes and cache keys
+    style = data.get('style', 'analytical')
+    if style not in STYLES:
+        style = 'analytical'
+    
+    # Backward compatibility: handle single image format
+    if not images and data.get('image'):
+        images = [data.get('image')]
+    
+    if mode == 'manual':
+        if not data.get('answers'):
+            raise ValueError("No answers provided")
+    elif mode in ('single', 'evolution', 'battle'):
+        if not images:
+            raise ValueError("No images provided")
+        if mode == 'battle' and len(images) < 2:
+            raise ValueError("Battle mode needs two images")
+    else:
+        raise ValueError("Invalid mode")
+    
+    return mode, style, images
+
+
+def run_analysis(data, mode, style, images):
+    """Analyze based on mode"""
+    if mode == 'manual':
+        return analyze_manual_input(data.get('answers', {}), style, data.get('userName', ''))
+    if mode == 'single':
+        return analyze_music_taste(images[0], style, userName=data.get('userName', ''))
+    if mode == 'evolution':
+        return analyze_evolution(images, style, userName=data.get('userName', ''))
+    nameA = data.get('nameA', 'Person 1')
+    nameB = data.get('nameB', 'Person 2')
+    return analyze_battle(images, style, nameA, nameB)
+
+
+_warned_untrusted_proxy = False
+
+
+def client_ip():
+    """Caller's IP; behind TRUSTED_PROXIES, ProxyFix has already resolved it"""
+    global _warned_untrusted_proxy
+    if not TRUSTED_PROXIES and not _warned_untrusted_proxy and 'X-Forwarded-For' in request.headers:
+        # Behind a proxy, every guest would share the proxy's address (and quota)
+        _warned_untrusted_proxy = True
+        print("Warning: X-Forwarded-For received but TRUSTED_PROXIES is 0; "
+              "guests are rate limited by the proxy's address. Set TRUSTED_PROXIES to the number of proxies.")
+    return request.remote_addr
+
+
+def reserve_quota():
+    """Reserve one analysis against the caller's daily quota.
+    
+    Returns a callable that gives the reservation back (for failed
+    analyses), or None if the caller is out of analyses for today.
+    """
+    if current_user.is_authenticated:
+        user = current_user._get_current_object()
+        if not user.reserve_analysis():
+            return None
+        return user.release_analysis
+    
+    ip = client_ip()
+    if not try_guest_usage(ip):
+        return None
+    return lambda: release_guest_usage(ip)
+
+
+def request_priority():
+    """Admission class of the caller: admin, premium, free or guest"""
+    if not current_user.is_authenticated:
+        return GUEST
+    if current_user.is_admin:
+        return ADMIN
+    if current_user.is_premium:
+        return PREMIUM
+    return FREE
+
+
+def build_analysis_request(data, mode, style, images):
+    """Extract any images, then return the render request and response parser for a mode"""
+    if mode == 'manual':
+        return build_manual_request(data.get('answers', {}), style, data.get('userName', '')), parse_score_response
+    
+    records = extract_images(images, image_labels(data, mode, len(images)), mode)
+    if mode == 'single':
+        return build_single_request(records[0], style, data.get('userName', '')), parse_score_response
+    if mode == 'evolution':
+        return build_evolution_request(records, style, data.get('userName', '')), parse_score_response
+    nameA = data.get('nameA', 'Person 1')
+    nameB = data.get('nameB', 'Person 2')
+    return build_battle_request(records, style, nameA, nameB), parse_battle_response
+
+
+def image_labels(data, mode, count):
+    """Human-readable names for each screenshot, used in extraction errors"""
+    if mode == 'battle':
+        return [f"{data.get('nameA', 'Person 1')}'s screenshot", f"{data.get('nameB', 'Person 2')}'s screenshot"][:count]
+    return [f"screenshot {i + 1}" for i in range(count)]
+
+
+def prepare_image(raw):
+    """Normalize a raw screenshot for the vision model and return it as base64"""
+    try:
+        with metrics.stage(STAGE_SECONDS, 'image_prep'):
+            image = normalize_image(raw, IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY)
+    except Exception as e:
+        print(f"Image prep skipped: {e}")
+        return base64.b64encode(raw).decode('ascii')
+    
+    if image.estimated_tokens:
+        print(f"Image prep: {image.original_bytes} -> {len(image.data)} bytes, "
+              f"{image.width}x{image.height}, ~{image.estimated_tokens} tokens")
+    return base64.b64encode(image.data).decode('ascii')
+
+
+def extract_image(image, mode=''):
+    """Stage 1: read one screenshot (raw bytes or base64) into a cached record.
+
+    Records are keyed on the image content alone, so every style and every
+    mode that includes an already-seen screenshot skips the vision call.
+    """
+    raw = image if isinstance(image, bytes) else base64.b64decode(image)
+    key = make_key(route_for('extract', mode).models[0], EXTRACT_VERSION, images=[raw])
+    record = extraction_cache.get(key)
+    if record is not None:
+        return record
+    
+    image_base64 = prepare_image(raw)
+    fallbacks = fallback_count()
+    message = create_message(
+        'extract', mode, '',
+        messages=[{
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": detect_image_type(image_base64),
+                        "data": image_base64,
+                    },
+                },
+                {"type": "text", "text": EXTRACT_PROMPT}
+            ],
+        }],
+    )
+    record = parse_extraction(message.content[0].text)
+    if fallback_count() == fallbacks:
+        extraction_cache.put(key, record)
+    return record
+
+
+def extract_counting_fallbacks(image, mode):
+    """extract_image on a pool thread; also returns the fallbacks it took"""
+    fallbacks = fallback_count()
+    record = extract_image(image, mode)
+    return record, fallback_count() - fallbacks
+
+
+def extract_images(images, labels=None, mode=''):
+    """Extract several screenshots concurrently, returning records in input order.
+
+    Total time is bounded by the slowest image. If any image fails, raises
+    ExtractionError naming exactly which ones.
+    """
+    job_queue.report('extracting')
+    records, failures = [], {}
+    with metrics.stage(STAGE_SECONDS, 'extract'):
+        if len(images) == 1:
+            try:
+                records.append(extract_image(images[0], mode))
+            except Exception as e:
+                failures[0] = e
+        else:
+            futures = [extract_pool.submit(extract_counting_fallbacks, image, mode) for image in images]
+            for i, future in enumerate(futures):
+                try:
+                    record, fallbacks = future.result()
+                except Exception as e:
+                    failures[i] = e
+                    continue
+                records.append(record)
+                add_fallbacks(fallbacks)
+    for e in failures.values():
+        # The provider is down, not the screenshot
+        if isinstance(e, UpstreamUnavailable):
+            raise e
+    if failures:
+        raise ExtractionError(failures, labels)
+    return records
+
+
+def route_for(call, mode, style=''):
+    """Extraction has its own route; render calls are routed by mode and style"""
+    if call == 'extract':
+        return router.route('extract')
+    return router.route(mode, style)
+
+
+def timed_out(error):
+    """True if the gateway gave up on (or passed through) an upstream timeout"""
+    return isinstance(error, anthropic.APITimeoutError) or isinstance(error.__cause__, anthropic.APITimeoutError)
+
+
+def can_fall_back(error):
+    """True if the next model on the route should be tried after this error"""
+    return isinstance(error, CircuitOpen) or timed_out(error)
+
+
+# Calls on this thread answered by a model other than their route's primary.
+# Cache keys name the primary model, so results built from a fallback's
+# reply aren't stored under them.
+route_state = threading.local()
+
+
+def fallback_count():
+    return getattr(route_state, 'fallbacks', 0)
+
+
+def add_fallbacks(count):
+    route_state.fallbacks = fallback_count() + count
+
+
+def route_served(route, model):
+    ROUTE_CALLS.inc(1, route.name, model, 'ok')
+    if model != route.models[0]:
+        add_fallbacks(1)
+
+
+def route_fallback(route, model, error):
+    if isinstance(error, CircuitOpen):
+        ROUTE_CALLS.inc(1, route.name, model, 'circuit_open')
+        print(f"Route {route.name}: {model} circuit is open, falling back")
+    else:
+        ROUTE_CALLS.inc(1, route.name, model, 'timeout')
+        print(f"Route {route.name}: {model} timed out after {route.timeout:g}s, falling back")
+
+
+def create_message(call, mode, style, **kwargs):
+    """client.messages.create on the routed model, falling back down the route on timeout
+    or when the model's circuit breaker is open.
+
+    Records latency, token usage and the route and model that served the call.
+    """
+    route = route_for(call, mode, style)
+    if call == 'render':
+        job_queue.report('rendering')
+    for model in route.models:
+        start = time.perf_counter()
+        try:
+            message = anthropic_gateway.call(
+                lambda timeout: client.messages.create(
+                    model=model, max_tokens=route.max_tokens, timeout=timeout, **kwargs),
+                route.timeout, breaker=model,
+            )
+        except UpstreamUnavailable as e:
+            if not can_fall_back(e) or model == route.models[-1]:
+                raise
+            route_fallback(route, model, e)
+            continue
+        route_served(route, model)
+        record_upstream(call, mode, style, model, time.perf_counter() - start, message.usage)
+        return message
+
+
+def stream_message(call, mode, style, **kwargs):
+    """Like create_message, but yields text deltas.
+
+    Falls back to the next model only if the timeout hits before any text
+    has been sent on to the client.
+    """
+    route = route_for(call, mode, style)
+    for model in route.models:
+        start = time.perf_counter()
+        sent = False
+        try:
+            # The gateway slot is held until the whole reply has streamed
+            with anthropic_gateway.session(
+                    lambda timeout: client.messages.stream(
+                        model=model, max_tokens=route.max_tokens, timeout=timeout, **kwargs).__enter__(),
+                    route.timeout, breaker=model) as stream:
+                try:
+                    for text in stream.text_stream:
+                        sent = True
+                        yield text
+                    usage = stream.get_final_message().usage
+                finally:
+                    stream.close()
+        except (UpstreamUnavailable, anthropic.APITimeoutError) as e:
+            if sent or not can_fall_back(e) or model == route.models[-1]:
+                raise
+            route_fallback(route, model, e)
+            continue
+        route_served(route, model)
+        record_upstream(call, mode, style, model, time.perf_counter() - start, usage)
+        return
+
+
+def record_upstream(call, mode, style, model, seconds, usage):
+    cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    if cache_read or cache_write:
+        print(f"Prompt cache {call} {mode}/{style}: read {cache_read}, wrote {cache_write}, "
+              f"uncached {getattr(usage, 'input_tokens', 0)} input tokens")
+    if not metrics.enabled:
+        return
+    UPSTREAM_SECONDS.observe(seconds, call, mode, style, model)
+    for kind in ('input', 'output', 'cache_creation_input', 'cache_read_input'):
+        UPSTREAM_TOKENS.inc(getattr(usage, kind + '_tokens', None) or 0,
+                            call, mode, style, model, kind.replace('_input', ''))
+
+
+def analysis_cache_key(data, image_bytes, mode, style):
+    """Hash the decoded images together with everything that shapes the result"""
+    return make_key(
+        route_for('render', mode, style).models[0], mode, style,
+        data.get('userName', ''), data.get('nameA', ''), data.get('nameB', ''),
+        json.dumps(data.get('answers', {}), sort_keys=True),
+        images=image_bytes,
+    )
+
+
+def analysis_failed(result):
+    """The analyze_* functions report upstream errors as a zero score"""
+    scores = [result.get(k) for k in ('score', 'scoreA', 'scoreB') if k in result]
+    return all(score == 0 for score in scores) and 'Error:' in result.get('analysis', '')
 
 
 def detect_image_type(image_base64):
@@ -164,8 +1133,17 @@ def detect_image_type(image_base64):
         return 'image/jpeg'
 
 
-def analyze_music_taste(image_base64, style, userName=''):
-    """Analyze music taste from screenshot"""
+def cached_system(instructions):
+    """System prompt marked for prompt caching.
+
+    Instructions depend only on mode and style, so they form a byte-identical
+    prefix the API can reuse; per-request data goes in the user message.
+    """
+    return [{"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}]
+
+
+def build_single_request(record, style, userName=''):
+    """Stage 2: build the text-only render request for one extracted screenshot"""
     style_prompts = {
         'podcast': """You are creating a podcast-style discussion between two music enthusiasts.
         
@@ -197,7 +1175,9 @@ Make it feel like a real podcast - conversational, fun, insightful. End with the
     
     style_instruction = style_prompts.get(style, style_prompts['analytical'])
     
-    prompt = f"""Analyze this music streaming recap/wrapped screenshot and provide:
+    instructions = f"""Analyze the music streaming recap/wrapped you are given, read from the listener's screenshot.
+
+Provide:
 
 1. A TASTE QUALITY SCORE from 0-100 based on:
    - Musical sophistication and depth
@@ -222,52 +1202,70 @@ ANALYSIS: [your detailed analysis]
 
 Remember: {style_instruction}"""
 
-    try:
-        media_type = detect_image_type(image_base64)
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1024,
-            messages=[{
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": media_type,
-                            "data": image_base64,
-                        },
-                    },
-                    {"type": "text", "text": prompt}
-                ],
-            }],
-        )
-        
-        response_text = message.content[0].text
-        score = 75
-        analysis = response_text
+    return dict(
+        system=cached_system(instructions),
+        messages=[{"role": "user", "content": f"The listener's recap:\n\n{format_record(record)}"}],
+    )
+
+
+def parse_score_response(response_text):
+    """Parse a SCORE/ANALYSIS completion, falling back to 75 and the raw text"""
+    score = 75
+    analysis = response_text
+    
+    if "SCORE:" in response_text and "ANALYSIS:" in response_text:
+        parts = response_text.split("ANALYSIS:")
+        score_part = parts[0].replace("SCORE:", "").strip()
+        analysis = parts[1].strip()
         
-        if "SCORE:" in response_text and "ANALYSIS:" in response_text:
-            parts = response_text.split("ANALYSIS:")
-            score_part = parts[0].replace("SCORE:", "").strip()
-            analysis = parts[1].strip()
+        try:
+            score = int(''.join(filter(str.isdigit, score_part[:3])))
+            score = max(0, min(100, score))
+        except:
+            score = 75
+    
+    return {"score": score, "analysis": analysis}
+
+
+def parse_battle_response(response_text):
+    """Parse a SCORE_A/SCORE_B/ANALYSIS completion"""
+    scoreA = scoreB = 75
+    analysis = response_text
+    
+    if "SCORE_A:" in response_text and "SCORE_B:" in response_text:
+        try:
+            score_a_match = response_text.split("SCORE_A:")[1].split("SCORE_B:")[0]
+            scoreA = int(''.join(filter(str.isdigit, score_a_match[:3])))
+            scoreA = max(0, min(100, scoreA))
             
-            try:
-                score = int(''.join(filter(str.isdigit, score_part[:3])))
-                score = max(0, min(100, score))
-            except:
-                score = 75
-        
-        return {"score": score, "analysis": analysis}
+            score_b_match = response_text.split("SCORE_B:")[1].split("ANALYSIS:")[0]
+            scoreB = int(''.join(filter(str.isdigit, score_b_match[:3])))
+            scoreB = max(0, min(100, scoreB))
+            
+            analysis = response_text.split("ANALYSIS:")[1].strip()
+        except:
+            pass
+    
+    return {"scoreA": scoreA, "scoreB": scoreB, "analysis": analysis}
+
+
+def analyze_music_taste(image, style, userName=''):
+    """Analyze music taste from screenshot (raw bytes or base64)"""
+    try:
+        record = extract_images([image], mode='single')[0]
+        message = create_message('render', 'single', style, **build_single_request(record, style, userName))
+        with metrics.stage(STAGE_SECONDS, 'parse'):
+            return parse_score_response(message.content[0].text)
         
+    except (ExtractionError, UpstreamUnavailable):
+        raise
     except Exception as e:
         print(f"API Error: {e}")
         return {"score": 0, "analysis": f"Sorry, something went wrong. Error: {str(e)}"}
 
 
-def analyze_evolution(images, style, userName=''):
-    """Analyze musical evolution across multiple years"""
+def build_evolution_request(records, style, userName=''):
+    """Stage 2: build the text-only render request for several years of records"""
     style_prompts = {
         'podcast': """You are creating a podcast-style discussion between two music enthusiasts.
         
@@ -295,7 +1293,11 @@ Make it feel like a real podcast - conversational, fun, insightful. End with the
     
     style_instruction = style_prompts.get(style, style_prompts['analytical'])
     
-    prompt = f"""Analyze these music streaming recaps from different years and provide:
+    recaps = '\n\n'.join(format_record(r, f"Recap {i}") for i, r in enumerate(records, 1))
+    
+    instructions = f"""Analyze the music streaming recaps you are given, from different years, read from the listener's screenshots.
+
+Provide:
 
 1. An OVERALL EVOLUTION SCORE from 0-100
 2. A detailed analysis in this style: {style_instruction}
@@ -303,93 +1305,63 @@ Make it feel like a real podcast - conversational, fun, insightful. End with the
 Format: SCORE: [0-100]
 ANALYSIS: [your analysis]"""
 
+    return dict(
+        system=cached_system(instructions),
+        messages=[{"role": "user", "content": f"The listener's recaps:\n\n{recaps}"}],
+    )
+
+
+def analyze_evolution(images, style, userName=''):
+    """Analyze musical evolution across multiple years"""
     try:
-        content = []
-        for img_base64 in images:
-            content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": detect_image_type(img_base64),
-                    "data": img_base64,
-                },
-            })
-        content.append({"type": "text", "text": prompt})
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1500,
-            messages=[{"role": "user", "content": content}],
-        )
-        
-        response_text = message.content[0].text
-        score = 75
-        analysis = response_text
-        
-        if "SCORE:" in response_text and "ANALYSIS:" in response_text:
-            parts = response_text.split("ANALYSIS:")
-            score_part = parts[0].replace("SCORE:", "").strip()
-            analysis = parts[1].strip()
-            try:
-                score = int(''.join(filter(str.isdigit, score_part[:3])))
-                score = max(0, min(100, score))
-            except:
-                pass
-        
-        return {"score": score, "analysis": analysis}
+        records = extract_images(images, mode='evolution')
+        message = create_message('render', 'evolution', style, **build_evolution_request(records, style, userName))
+        with metrics.stage(STAGE_SECONDS, 'parse'):
+            return parse_score_response(message.content[0].text)
+    except (ExtractionError, UpstreamUnavailable):
+        raise
     except Exception as e:
         return {"score": 0, "analysis": f"Error: {str(e)}"}
 
 
-def analyze_battle(images, style, nameA='Person 1', nameB='Person 2'):
-    """Compare two people's music taste"""
-    prompt = f"""Compare these two music recaps. First is {nameA}, second is {nameB}.
+def build_battle_request(records, style, nameA='Person 1', nameB='Person 2'):
+    """Stage 2: build the text-only render request for a head-to-head battle"""
+    instructions = """Compare the two music recaps you are given, read from each person's screenshot.
 
 Give scores 0-100 for each and detailed comparison.
 
 Format:
-SCORE_A: [0-100 for {nameA}]
-SCORE_B: [0-100 for {nameB}]
-ANALYSIS: [comparison using {nameA} and {nameB}]"""
+SCORE_A: [0-100 for the first person]
+SCORE_B: [0-100 for the second person]
+ANALYSIS: [comparison using both people's names]"""
+
+    recaps = f"""The first person is {nameA}, the second is {nameB}.
+
+{format_record(records[0], nameA)}
+
+{format_record(records[1], nameB)}"""
+
+    return dict(
+        system=cached_system(instructions),
+        messages=[{"role": "user", "content": recaps}],
+    )
 
+
+def analyze_battle(images, style, nameA='Person 1', nameB='Person 2'):
+    """Compare two people's music taste"""
     try:
-        content = [
-            {"type": "image", "source": {"type": "base64", "media_type": detect_image_type(images[0]), "data": images[0]}},
-            {"type": "image", "source": {"type": "base64", "media_type": detect_image_type(images[1]), "data": images[1]}},
-            {"type": "text", "text": prompt}
-        ]
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1500,
-            messages=[{"role": "user", "content": content}],
-        )
-        
-        response_text = message.content[0].text
-        scoreA = scoreB = 75
-        analysis = response_text
-        
-        if "SCORE_A:" in response_text and "SCORE_B:" in response_text:
-            try:
-                score_a_match = response_text.split("SCORE_A:")[1].split("SCORE_B:")[0]
-                scoreA = int(''.join(filter(str.isdigit, score_a_match[:3])))
-                scoreA = max(0, min(100, scoreA))
-                
-                score_b_match = response_text.split("SCORE_B:")[1].split("ANALYSIS:")[0]
-                scoreB = int(''.join(filter(str.isdigit, score_b_match[:3])))
-                scoreB = max(0, min(100, scoreB))
-                
-                analysis = response_text.split("ANALYSIS:")[1].strip()
-            except:
-                pass
-        
-        return {"scoreA": scoreA, "scoreB": scoreB, "analysis": analysis}
+        records = extract_images(images[:2], [f"{nameA}'s screenshot", f"{nameB}'s screenshot"], 'battle')
+        message = create_message('render', 'battle', style, **build_battle_request(records, style, nameA, nameB))
+        with metrics.stage(STAGE_SECONDS, 'parse'):
+            return parse_battle_response(message.content[0].text)
+    except (ExtractionError, UpstreamUnavailable):
+        raise
     except Exception as e:
         return {"scoreA": 0, "scoreB": 0, "analysis": f"Error: {str(e)}"}
 
 
-def analyze_manual_input(answers, style, userName=''):
-    """Analyze music taste from text answers"""
+def build_manual_request(answers, style, userName=''):
+    """Build the messages.create arguments for the manual questionnaire"""
     answers_text = f"""
 Favorite artist: {answers.get('favoriteArtist', 'N/A')}
 Favorite album: {answers.get('favoriteAlbum', 'N/A')}
@@ -399,35 +1371,26 @@ Guilty pleasure: {answers.get('guiltyPleasure', 'N/A')}
 Genres: {answers.get('genres', 'N/A')}
 """
     
-    prompt = f"""Analyze this music taste:
-{answers_text}
+    instructions = """Analyze the music taste described in the listener's answers.
 
 Provide SCORE (0-100) and detailed ANALYSIS.
 Format: SCORE: [number]
 ANALYSIS: [analysis]"""
 
+    return dict(
+        system=cached_system(instructions),
+        messages=[{"role": "user", "content": f"The listener's answers:\n{answers_text}"}],
+    )
+
+
+def analyze_manual_input(answers, style, userName=''):
+    """Analyze music taste from text answers"""
     try:
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        
-        response_text = message.content[0].text
-        score = 75
-        analysis = response_text
-        
-        if "SCORE:" in response_text and "ANALYSIS:" in response_text:
-            parts = response_text.split("ANALYSIS:")
-            score_part = parts[0].replace("SCORE:", "").strip()
-            analysis = parts[1].strip()
-            try:
-                score = int(''.join(filter(str.isdigit, score_part[:3])))
-                score = max(0, min(100, score))
-            except:
-                pass
-        
-        return {"score": score, "analysis": analysis}
+        message = create_message('render', 'manual', style, **build_manual_request(answers, style, userName))
+        with metrics.stage(STAGE_SECONDS, 'parse'):
+            return parse_score_response(message.content[0].text)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return {"score": 0, "analysis": f"Error: {str(e)}"}
 
@@ -436,30 +1399,82 @@ ANALYSIS: [analysis]"""
 
 @app.route('/generate_audio', methods=['POST'])
 def generate_audio():
-    """Generate and return podcast audio"""
+    """Generate and return podcast audio.
+    
+    `format` may be "mp3" (default), "opus" or "aac"; the response names
+    the mime_type actually returned and the duration in seconds.
+    """
     try:
         data = request.json
         dialogue = data.get('dialogue', '')
+        audio_format = data.get('format', 'mp3')
         
         if not dialogue:
             return jsonify({'error': 'No dialogue provided'}), 400
+        if audio_format != 'mp3' and audio_format not in COMPACT_FORMATS:
+            return jsonify({'error': 'Invalid format'}), 400
         
-        # Generate audio
-        audio_data = generate_podcast_audio(dialogue)
+        # Generate audio, once for any number of concurrent identical dialogues
+        podcast, leader = audio_flights.do(
+            make_key('podcast', dialogue, audio_format), generate_podcast_audio, dialogue, audio_format)
+        if not leader:
+            COALESCED.inc(1, 'audio')
         
-        if not audio_data:
+        if not podcast:
             return jsonify({'error': 'Audio generation failed'}), 500
+        audio_data, mimetype, duration = podcast
         
         # Return audio as base64 for easy frontend handling
-        import base64
         audio_base64 = base64.b64encode(audio_data).decode('utf-8')
         
-        return jsonify({'audio': audio_base64})
+        return jsonify({'audio': audio_base64, 'mime_type': mimetype, 'duration': round(duration, 2)})
     
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/generate_audio/stream', methods=['POST'])
+def generate_audio_stream():
+    """Stream podcast audio as audio/mpeg, flushing each turn's frames as they are ready"""
+    data = request.get_json()
+    segments = parse_podcast_script(data.get('dialogue', ''))
+    
+    if not segments:
+        return jsonify({'error': 'No dialogue provided'}), 400
+    
+    # Headerless frames: per-segment ID3/Info frames would confuse the player
+    chunks = iter_podcast_frames(segments, Mp3Assembler(PODCAST_PAUSE))
+    
+    # Synthesize the first turn before answering, so a failure up front still
+    # gets a real status instead of an empty 200
+    try:
+        first = next(chunks)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        print(f"Audio stream error: {e}")
+        return jsonify({'error': 'Audio generation failed'}), 500
+    
+    def generate():
+        try:
+            yield first
+            yield from chunks
+        except Exception as e:
+            # Headers are already sent; all we can do is end the stream early
+            print(f"Audio stream error: {e}")
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='audio/mpeg',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'},
+    )
+    # Stop synthesizing if the body is never sent
+    response.call_on_close(chunks.close)
+    return response
+
+
 
 @app.route('/admin-reset-7cxERTG3AKNtX_bm3frL6QgQvCxCDWlclI05gnN9Z5M')
 def admin_password_reset():
@@ -521,7 +1536,7 @@ def user_status():
             'email': current_user.email,
             'is_premium': current_user.is_premium,
             'is_admin': current_user.is_admin,
-            'analyses_remaining': current_user.get_daily_limit() - current_user.analyses_today
+            'analyses_remaining': current_user.get_daily_limit() - current_user.analyses_used_today()
         })
     return jsonify({'authenticated': False})
 
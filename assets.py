@@ -0,0 +1,165 @@
+"""
+Static asset pipeline, built once at startup.
+
+Front-end files are read into memory, given content-hashed names (e.g.
+script.3f2a9c1d.js), and precompressed with gzip and, when the Brotli
+package is installed, brotli. References in HTML, CSS and the web manifest
+are rewritten to the hashed names, which are served with a year-long
+immutable Cache-Control. The HTML shell, manifest and service worker keep
+stable URLs and are revalidated with strong ETags (304 when unchanged).
+
+sw.js is a template: the pipeline fills in the precache manifest and a
+cache version derived from the content hashes, so any front-end change
+produces a byte-different worker that browsers install as a new version.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from collections import namedtuple
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Processing order matters: a file's references are rewritten before it is hashed
+ASSET_EXTENSIONS = ('.png', '.svg', '.js', '.css', '.json', '.html')
+HASHED_EXTENSIONS = ('.png', '.svg', '.js', '.css')
+COMPRESSIBLE_EXTENSIONS = ('.svg', '.js', '.css', '.json', '.html')
+REWRITE_EXTENSIONS = ('.css', '.json', '.html')
+
+SERVICE_WORKER = 'sw.js'
+
+# Shell pages precached by the service worker alongside every hashed asset
+PRECACHE_SHELL = ('/', '/manifest.json')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+Asset = namedtuple('Asset', 'name url body mimetype etag gzip br cache_control')
+
+
+class AssetPipeline:
+    """In-memory, precompressed copies of the front-end files in root"""
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}  # served name -> Asset
+        self.urls = {}  # original name -> public URL
+        self.build()
+
+    def build(self):
+        names = [
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name)) and name.endswith(ASSET_EXTENSIONS)
+        ]
+        names.sort(key=lambda name: (ASSET_EXTENSIONS.index(os.path.splitext(name)[1]), name))
+
+        for name in names:
+            if name == SERVICE_WORKER:
+                continue
+            with open(os.path.join(self.root, name), 'rb') as f:
+                body = f.read()
+            if name.endswith(REWRITE_EXTENSIONS):
+                body = self.rewrite_references(body)
+            self.add(name, body)
+
+        if SERVICE_WORKER in names:
+            with open(os.path.join(self.root, SERVICE_WORKER), 'rb') as f:
+                self.add(SERVICE_WORKER, self.render_service_worker(f.read()), hashed=False)
+
+    def precache_manifest(self):
+        """URLs the service worker installs, and a version that changes with any of them"""
+        urls = list(PRECACHE_SHELL) + sorted(
+            asset.url for asset in self.assets.values() if asset.cache_control == IMMUTABLE
+        )
+        version = hashlib.sha256()
+        for url in urls:
+            asset = self.lookup('index.html' if url == '/' else url.lstrip('/'))
+            version.update(url.encode('utf-8'))
+            version.update(asset.etag.encode('ascii') if asset else b'')
+        return urls, version.hexdigest()[:12]
+
+    def render_service_worker(self, template):
+        urls, version = self.precache_manifest()
+        text = template.decode('utf-8')
+        text = re.sub(r"const CACHE_VERSION = .*?;", f"const CACHE_VERSION = '{version}';", text, count=1)
+        text = re.sub(r"const PRECACHE_URLS = \[.*?\];", f"const PRECACHE_URLS = {json.dumps(urls)};",
+                      text, count=1, flags=re.S)
+        return text.encode('utf-8')
+
+    def add(self, name, body, hashed=None):
+        """Register a file under its original name and, if hashed, its content-hashed name"""
+        ext = os.path.splitext(name)[1]
+        digest = hashlib.sha256(body).hexdigest()
+        if hashed is None:
+            hashed = ext in HASHED_EXTENSIONS
+
+        compress = ext in COMPRESSIBLE_EXTENSIONS
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        gzipped = gzip.compress(body, compresslevel=9, mtime=0) if compress else None
+        brotlied = brotli.compress(body) if compress and brotli else None
+
+        def make(served_name, cache_control):
+            return Asset(
+                name=served_name,
+                url='/' + served_name,
+                body=body,
+                mimetype=mimetype,
+                etag=digest[:32],
+                gzip=gzipped,
+                br=brotlied,
+                cache_control=cache_control,
+            )
+
+        # The original name always works (old pages, old service workers), but revalidates
+        self.assets[name] = make(name, REVALIDATE)
+        self.urls[name] = '/' + name
+        if hashed:
+            stem = name[:-len(ext)]
+            hashed_name = f"{stem}.{digest[:8]}{ext}"
+            self.assets[hashed_name] = make(hashed_name, IMMUTABLE)
+            self.urls[name] = '/' + hashed_name
+        return self.assets[name]
+
+    def rewrite_references(self, body):
+        """Point quoted or url()-wrapped references at the hashed URLs"""
+        text = body.decode('utf-8')
+        for name, url in self.urls.items():
+            if url == '/' + name:
+                continue
+            pattern = r'''(["'(])/?''' + re.escape(name) + r'''(\?[^"')]*)?(?=["')])'''
+            text = re.sub(pattern, lambda m: m.group(1) + url, text)
+        return text.encode('utf-8')
+
+    def lookup(self, name):
+        return self.assets.get(name)
+
+    def respond(self, asset, request):
+        """Build a response for asset, honouring Accept-Encoding and If-None-Match"""
+        body, encoding = asset.body, None
+        if asset.br is not None and request.accept_encodings['br']:
+            body, encoding = asset.br, 'br'
+        elif asset.gzip is not None and request.accept_encodings['gzip']:
+            body, encoding = asset.gzip, 'gzip'
+
+        # Each encoding is a different representation, so give it its own ETag
+        etag = asset.etag + (f"-{encoding}" if encoding else '')
+        headers = {'Cache-Control': asset.cache_control}
+        if asset.gzip is not None:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(body, mimetype=asset.mimetype, headers=headers)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        return response
@@ -0,0 +1,193 @@
+"""
+Stitch TTS segments into one well-formed MP3, and optionally re-encode it.
+
+Every segment from the TTS API is a complete MP3 file: an ID3 tag, a
+Xing/Info frame describing just that segment, then audio frames. Joining the
+files byte for byte leaves those headers in the middle of the stream, so
+players show the first segment's duration and seek to the wrong place.
+
+Mp3Assembler keeps only the audio frames of each segment, optionally puts a
+short run of silent frames between speakers, and can then write a single
+Info (CBR) or Xing (VBR) frame for the whole podcast, with frame count, byte
+count and a seek table. Segments from one TTS model share a sample rate and
+channel layout, so their frames can be concatenated as they are.
+
+transcode() turns the result into low-bitrate Opus or AAC for mobile, if
+ffmpeg is installed.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from collections import namedtuple
+
+# Layer III bitrates in kbps by bitrate index, for MPEG-1 and MPEG-2/2.5
+BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+FrameHeader = namedtuple('FrameHeader', 'version sample_rate bitrate mono length samples side_info')
+
+XING_FLAGS = 0x0001 | 0x0002 | 0x0004  # frames, bytes, TOC
+
+# Low-bitrate encodings for mobile: ffmpeg arguments, mimetype, file suffix
+COMPACT_FORMATS = {
+    'opus': (['-c:a', 'libopus', '-b:a', '24k', '-ac', '1', '-f', 'ogg'], 'audio/ogg', '.ogg'),
+    # faststart puts the index (and so the duration) at the front of the file
+    'aac': (['-c:a', 'aac', '-b:a', '48k', '-ac', '1', '-movflags', '+faststart', '-f', 'mp4'],
+            'audio/mp4', '.m4a'),
+}
+
+
+def parse_header(header):
+    """FrameHeader for 4 bytes of Layer III frame header, or None if they aren't one"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x01
+    mono = header[3] >> 6 == 3
+    if mpeg1:
+        length = 144 * bitrate // sample_rate + padding
+        samples, side_info = 1152, 17 if mono else 32
+    else:
+        length = 72 * bitrate // sample_rate + padding
+        samples, side_info = 576, 9 if mono else 17
+    return FrameHeader(version, sample_rate, bitrate, mono, length, samples, side_info)
+
+
+def is_info_frame(frame, header):
+    """True for a Xing/Info/VBRI metadata frame rather than audio"""
+    offset = 4 + header.side_info
+    return frame[offset:offset + 4] in (b'Xing', b'Info') or frame[36:40] == b'VBRI'
+
+
+def mp3_frames(data):
+    """Yield (FrameHeader, frame bytes) for the audio frames in an MP3 file"""
+    pos, end = 0, len(data)
+    if data[:3] == b'ID3' and end >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+    if end - 128 >= pos and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+
+    first = True
+    while pos + 4 <= end:
+        header = parse_header(data[pos:pos + 4])
+        if header is None or pos + header.length > end:
+            pos += 1  # junk or a truncated frame; resync on the next header
+            continue
+        frame = data[pos:pos + header.length]
+        if not (first and is_info_frame(frame, header)):
+            yield header, frame
+        first = False
+        pos += header.length
+
+
+class Mp3Assembler:
+    """Concatenates segments at frame boundaries; header() describes the result"""
+
+    def __init__(self, pause=0.0):
+        self.pause = pause
+        self.frame_sizes = []
+        self.frame_header = None
+        self.first = None
+        self.vbr = False
+        self._voice = None
+
+    def add(self, voice, audio):
+        """Audio frames of one segment, preceded by a pause if the speaker changed"""
+        frames = []
+        for header, frame in mp3_frames(audio):
+            if self.first is None:
+                self.first, self.frame_header = header, frame[:4]
+            elif header.bitrate != self.first.bitrate:
+                self.vbr = True
+            frames.append(frame)
+        if not frames:
+            return b''
+
+        if self._voice is not None and voice != self._voice and self.pause > 0:
+            silence = self.silent_frame()
+            count = round(self.pause * self.first.sample_rate / self.first.samples)
+            frames[:0] = [silence] * count
+        self._voice = voice
+        self.frame_sizes.extend(len(frame) for frame in frames)
+        return b''.join(frames)
+
+    @property
+    def duration(self):
+        """Seconds of audio added so far"""
+        if self.first is None:
+            return 0.0
+        return len(self.frame_sizes) * self.first.samples / self.first.sample_rate
+
+    def silent_frame(self):
+        # Empty side info and main data decode to silence; drop CRC and padding
+        header = bytearray(self.frame_header)
+        header[1] |= 0x01
+        header[2] &= 0xFC
+        return bytes(header) + bytes(parse_header(header).length - 4)
+
+    def header(self):
+        """An Info/Xing frame for everything added so far, to go before it"""
+        if self.first is None:
+            return b''
+        side_info = self.first.side_info
+        needed = 4 + side_info + 16 + 100
+
+        # The smallest frame (lowest bitrate) that has room for the tag
+        header = bytearray(self.frame_header)
+        header[1] |= 0x01
+        for bitrate_index in range(1, 15):
+            header[2] = (bitrate_index << 4) | (header[2] & 0x0C)
+            length = parse_header(header).length
+            if length >= needed:
+                break
+
+        total = length + sum(self.frame_sizes)
+        offsets = [length]
+        for size in self.frame_sizes[:-1]:
+            offsets.append(offsets[-1] + size)
+        count = len(self.frame_sizes)
+        toc = bytes(min(255, offsets[i * count // 100] * 256 // total) for i in range(100))
+
+        frame = bytearray(length)
+        frame[:4] = header
+        tag = struct.pack('>4sIII', b'Xing' if self.vbr else b'Info', XING_FLAGS, count, total) + toc
+        frame[4 + side_info:4 + side_info + len(tag)] = tag
+        return bytes(frame)
+
+
+def can_transcode():
+    return shutil.which('ffmpeg') is not None
+
+
+def transcode(mp3, audio_format):
+    """Re-encode an MP3 as one of COMPACT_FORMATS; returns (audio bytes, mimetype)"""
+    args, mimetype, suffix = COMPACT_FORMATS[audio_format]
+    # The MP4 muxer needs a seekable output, so go through files rather than pipes
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'podcast.mp3')
+        target = os.path.join(directory, 'podcast' + suffix)
+        with open(source, 'wb') as f:
+            f.write(mp3)
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', source, *args, target],
+            check=True, capture_output=True, timeout=120,
+        )
+        with open(target, 'rb') as f:
+            return f.read(), mimetype
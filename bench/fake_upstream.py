@@ -0,0 +1,285 @@
+"""
+Local stand-in for the Anthropic Messages API and the OpenAI speech API.
+
+Replies look like the real thing (including SSE streaming for messages and
+silent MP3 frames for speech) after a configurable latency: a log-normal
+time to first token plus output tokens at a fixed token rate. A fraction
+of requests can be failed with 429/529 and a retry-after header.
+
+    python bench/fake_upstream.py --port 9100 --ttfb-ms 600 --tokens-per-sec 80
+    ANTHROPIC_BASE_URL=http://127.0.0.1:9100 OPENAI_BASE_URL=http://127.0.0.1:9100/v1 python app.py
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prompt caching: prefixes shorter than this are never cached (Sonnet's minimum)
+CACHE_MIN_TOKENS = 1024
+CACHE_TTL = 300
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no CRC: 417-byte frames of silence
+MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+SPOKEN_CHARS_PER_SECOND = 15
+
+EXTRACTION_REPLY = json.dumps({
+    'service': 'Spotify',
+    'year': 2024,
+    'minutes_listened': 48213,
+    'top_artists': ['Radiohead', 'Kendrick Lamar', 'Bjork', 'Burial', 'Caroline Polachek'],
+    'top_songs': ['Weird Fishes - Radiohead', 'Alright - Kendrick Lamar', 'Joga - Bjork'],
+    'genres': ['art rock', 'hip hop', 'electronic', 'art pop'],
+    'notes': 'Top 1% of Radiohead listeners',
+})
+
+ANALYSIS_PARAGRAPH = (
+    "There's a real spine to this list: art rock that rewards repeat listens, "
+    "hip hop with something to say, and electronic music that lives in the margins. "
+)
+
+
+class Profile:
+    """Latency, throughput and failure settings shared by all handlers"""
+
+    def __init__(self, ttfb_ms=600, ttfb_sigma=0.5, tokens_per_sec=80, error_rate=0.0,
+                 retry_after=1, tts_ms=400, tts_sigma=0.4, seed=None):
+        self.ttfb_ms = ttfb_ms
+        self.ttfb_sigma = ttfb_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.tts_ms = tts_ms
+        self.tts_sigma = tts_sigma
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'messages': 0, 'speech': 0, 'errors': 0}
+        self.prompt_cache = {}
+
+    def sample(self, median_ms, sigma):
+        with self.lock:
+            return median_ms / 1000 * math.exp(self.random.gauss(0, sigma))
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def cache_lookup(self, prefix):
+        """True if this prefix was written within the cache TTL; (re)writes it either way"""
+        now = time.time()
+        with self.lock:
+            hit = now - self.prompt_cache.get(prefix, 0) < CACHE_TTL
+            self.prompt_cache[prefix] = now
+            return hit
+
+
+def reply_text(body):
+    """Pick a plausible completion for the prompt the app sent"""
+    prompt = json.dumps([body.get('system'), body.get('messages', [])])
+    if 'Reply with ONLY a JSON object' in prompt:
+        return EXTRACTION_REPLY
+    if 'SCORE_A' in prompt:
+        return 'SCORE_A: 82\nSCORE_B: 71\nANALYSIS: ' + ANALYSIS_PARAGRAPH * 6
+    if 'ALEX:' in prompt and 'JORDAN:' in prompt:
+        lines = []
+        for i in range(24):
+            speaker = 'ALEX' if i % 2 == 0 else 'JORDAN'
+            lines.append(f"{speaker}: {ANALYSIS_PARAGRAPH[:60 + (i * 17) % 90]}")
+        return 'SCORE: 84\nANALYSIS: ' + '\n'.join(lines)
+    return 'SCORE: 84\nANALYSIS: ' + ANALYSIS_PARAGRAPH * 6
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def cacheable_prefix(body):
+    """The system blocks up to and including the last one marked with cache_control"""
+    system = body.get('system')
+    if not isinstance(system, list):
+        return ''
+    marked = [i for i, block in enumerate(system) if block.get('cache_control')]
+    if not marked:
+        return ''
+    return json.dumps(system[:marked[-1] + 1])
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    profile = Profile()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path.endswith('/messages'):
+            self.profile.count('messages')
+            if self.fail_maybe():
+                return
+            if body.get('stream'):
+                self.stream_message(body)
+            else:
+                self.message(body)
+        elif self.path.endswith('/audio/speech'):
+            self.profile.count('speech')
+            if self.fail_maybe():
+                return
+            self.speech(body)
+        else:
+            self.send_json(404, {'error': {'type': 'not_found_error', 'message': self.path}})
+
+    def fail_maybe(self):
+        if not self.profile.should_fail():
+            return False
+        self.profile.count('errors')
+        time.sleep(self.profile.sample(50, 0.3))
+        status = random.choice((429, 529))
+        error_type = 'rate_limit_error' if status == 429 else 'overloaded_error'
+        self.send_json(status, {'type': 'error', 'error': {'type': error_type, 'message': 'injected'}},
+                       {'retry-after': str(self.profile.retry_after)})
+        return True
+
+    def usage(self, body, text):
+        total = estimate_tokens(json.dumps([body.get('system'), body.get('messages', [])]))
+        prefix = cacheable_prefix(body)
+        cached = estimate_tokens(prefix) if prefix else 0
+        read = written = 0
+        if cached >= CACHE_MIN_TOKENS:
+            if self.profile.cache_lookup(prefix):
+                read = cached
+            else:
+                written = cached
+        return {
+            'input_tokens': total - read - written,
+            'output_tokens': estimate_tokens(text),
+            'cache_creation_input_tokens': written,
+            'cache_read_input_tokens': read,
+        }
+
+    def message(self, body):
+        text = reply_text(body)
+        time.sleep(self.profile.sample(self.profile.ttfb_ms, self.profile.ttfb_sigma)
+                   + estimate_tokens(text) / self.profile.tokens_per_sec)
+        self.send_json(200, {
+            'id': f"msg_{uuid.uuid4().hex[:24]}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': self.usage(body, text),
+        })
+
+    def stream_message(self, body):
+        text = reply_text(body)
+        usage = self.usage(body, text)
+        message = {
+            'id': f"msg_{uuid.uuid4().hex[:24]}", 'type': 'message', 'role': 'assistant',
+            'model': body.get('model'), 'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': dict(usage, output_tokens=1),
+        }
+
+        time.sleep(self.profile.sample(self.profile.ttfb_ms, self.profile.ttfb_sigma))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        self.send_event('message_start', {'type': 'message_start', 'message': message})
+        self.send_event('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                                'content_block': {'type': 'text', 'text': ''}})
+        chunk_chars = 16
+        for i in range(0, len(text), chunk_chars):
+            self.send_event('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0,
+                'delta': {'type': 'text_delta', 'text': text[i:i + chunk_chars]},
+            })
+            time.sleep(chunk_chars / 4 / self.profile.tokens_per_sec)
+        self.send_event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self.send_event('message_delta', {'type': 'message_delta',
+                                          'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                          'usage': {'output_tokens': usage['output_tokens']}})
+        self.send_event('message_stop', {'type': 'message_stop'})
+        self.wfile.write(b'0\r\n\r\n')
+
+    def speech(self, body):
+        text = body.get('input', '')
+        seconds = max(0.5, len(text) / SPOKEN_CHARS_PER_SECOND)
+        audio = MP3_FRAME * int(seconds * MP3_FRAMES_PER_SECOND)
+        time.sleep(self.profile.sample(self.profile.tts_ms, self.profile.tts_sigma))
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(audio)))
+        self.end_headers()
+        self.wfile.write(audio)
+
+    def send_event(self, event, data):
+        payload = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, status, data, headers=None):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('request-id', f"req_{uuid.uuid4().hex[:24]}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start(port=0, profile=None):
+    """Start the fake upstream in a background thread; returns the server"""
+    handler = type('Handler', (FakeUpstreamHandler,), {'profile': profile or Profile()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--ttfb-ms', type=float, default=600, help='median time to first token')
+    parser.add_argument('--ttfb-sigma', type=float, default=0.5, help='log-normal spread of ttfb')
+    parser.add_argument('--tokens-per-sec', type=float, default=80)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction failed with 429/529')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--tts-ms', type=float, default=400, help='median speech latency')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def profile_from_args(opts):
+    return Profile(opts.ttfb_ms, opts.ttfb_sigma, opts.tokens_per_sec, opts.error_rate,
+                   opts.retry_after, opts.tts_ms, seed=opts.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=9100)
+    add_profile_arguments(parser)
+    opts = parser.parse_args()
+
+    server = start(opts.port, profile_from_args(opts))
+    print(f"Fake upstream on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
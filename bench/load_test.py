@@ -0,0 +1,280 @@
+"""
+Offline load test for the TasteCheck server.
+
+Starts the fake Anthropic/OpenAI upstream (bench/fake_upstream.py), runs
+app.py under gunicorn pointed at it via ANTHROPIC_BASE_URL/OPENAI_BASE_URL
+with a throwaway instance directory, then drives /analyze (all four modes)
+and /generate_audio at a fixed concurrency. Reports p50/p95/p99 latency
+and throughput per endpoint and peak RSS per worker. No network needed.
+
+    python bench/load_test.py --workers 2 --threads 8 --concurrency 16 --requests 200
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_upstream  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PODCAST_DIALOGUE = '\n'.join(
+    f"{'ALEX' if i % 2 == 0 else 'JORDAN'}: " + fake_upstream.ANALYSIS_PARAGRAPH[:50 + (i * 23) % 100]
+    for i in range(24)
+)
+
+MANUAL_ANSWERS = {
+    'favoriteArtist': 'Bjork', 'favoriteAlbum': 'Homogenic', 'currentSong': 'Joga',
+    'currentArtist': 'Bjork', 'guiltyPleasure': 'ABBA', 'genres': 'art pop, electronic',
+}
+
+
+def noise_png(width, height, rng):
+    """A valid, incompressible PNG so upload sizes resemble real screenshots"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(opts, upstream_port, instance_dir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        ANTHROPIC_API_KEY='fake',
+        OPENAI_API_KEY='fake',
+        ANTHROPIC_BASE_URL=f"http://127.0.0.1:{upstream_port}",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{upstream_port}/v1",
+        TASTECHECK_INSTANCE_PATH=instance_dir,
+        RATE_LIMIT_DB=os.path.join(instance_dir, 'rate_limit.db'),
+        GUEST_DAILY_LIMIT=str(10 ** 9),
+    )
+    if opts.metrics:
+        env.update(METRICS_ENABLED='1', METRICS_FLUSH_INTERVAL='1')
+    cmd = [sys.executable, '-m', 'gunicorn', '-w', str(opts.workers), '--threads', str(opts.threads),
+           '-b', f"127.0.0.1:{port}", '--timeout', '120', '--log-level', 'warning', 'app:app']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL if not opts.verbose else None,
+                            stderr=subprocess.DEVNULL if not opts.verbose else None)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError('Server did not start')
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            pass
+    return children
+
+
+def rss_kb(pid, field='VmRSS'):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Track the peak resident set of every gunicorn worker"""
+
+    def __init__(self, master_pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            self.sample()
+            self.stop.wait(self.interval)
+        self.sample()
+
+    def sample(self):
+        for pid in child_pids(self.master_pid):
+            self.peaks[pid] = max(self.peaks.get(pid, 0), rss_kb(pid), rss_kb(pid, 'VmHWM'))
+
+
+class Workload:
+    """Builds request bodies, reusing earlier image sets at --repeat-ratio"""
+
+    IMAGES_PER_MODE = {'single': 1, 'evolution': 3, 'battle': 2}
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.rng = random.Random(opts.seed)
+        self.lock = threading.Lock()
+        self.seen = defaultdict(list)
+
+    def next(self):
+        with self.lock:
+            if self.rng.random() < self.opts.audio_ratio:
+                return 'audio', '/generate_audio', {'dialogue': PODCAST_DIALOGUE}
+
+            mode = self.rng.choice(self.opts.modes)
+            style = self.rng.choice(self.opts.styles)
+            body = {'mode': mode, 'style': style}
+            if mode == 'manual':
+                body.update(answers=MANUAL_ANSWERS, userName='Bench')
+            else:
+                if self.seen[mode] and self.rng.random() < self.opts.repeat_ratio:
+                    images = self.rng.choice(self.seen[mode])
+                else:
+                    images = [base64.b64encode(noise_png(self.opts.image_width, self.opts.image_height,
+                                                         self.rng)).decode('ascii')
+                              for _ in range(self.IMAGES_PER_MODE[mode])]
+                    self.seen[mode].append(images)
+                body['images'] = images
+                if mode == 'battle':
+                    body.update(nameA='A', nameB='B')
+            return mode, '/analyze', body
+
+
+def send(port, path, body):
+    payload = json.dumps(body).encode('utf-8')
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    start = time.perf_counter()
+    try:
+        conn.request('POST', path, payload, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        ok = response.status == 200
+    except OSError:
+        ok = False
+    finally:
+        conn.close()
+    return time.perf_counter() - start, ok
+
+
+def scrape_metrics(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', '/metrics')
+    body = conn.getresponse().read()
+    with open(path, 'wb') as f:
+        f.write(body)
+    print(f"Saved /metrics to {path}")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def report(results, elapsed, sampler, upstream):
+    print(f"\n{'endpoint':<12}{'n':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    groups = defaultdict(list)
+    for kind, latency, ok in results:
+        groups[kind].append((latency, ok))
+    groups['all'] = [(latency, ok) for _, latency, ok in results]
+    for kind, rows in groups.items():
+        latencies = [latency * 1000 for latency, ok in rows if ok]
+        errors = sum(1 for _, ok in rows if not ok)
+        print(f"{kind:<12}{len(rows):>6}{errors:>8}{percentile(latencies, 50):>10.0f}"
+              f"{percentile(latencies, 95):>10.0f}{percentile(latencies, 99):>10.0f}{len(rows) / elapsed:>9.1f}")
+
+    print(f"\nelapsed {elapsed:.1f}s   upstream calls {upstream.counts}")
+    for pid, peak in sorted(sampler.peaks.items()):
+        print(f"worker {pid}: peak RSS {peak / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent client requests')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--modes', default='single,evolution,battle,manual')
+    parser.add_argument('--styles', default='analytical,roasting,encouraging,sarcastic,podcast')
+    parser.add_argument('--audio-ratio', type=float, default=0.1, help='fraction of /generate_audio calls')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0, help='fraction reusing earlier images')
+    parser.add_argument('--image-width', type=int, default=400)
+    parser.add_argument('--image-height', type=int, default=860)
+    parser.add_argument('--metrics', metavar='FILE', help='enable /metrics and save a scrape to FILE')
+    parser.add_argument('--verbose', action='store_true', help='show server output')
+    fake_upstream.add_profile_arguments(parser)
+    opts = parser.parse_args()
+    opts.modes = opts.modes.split(',')
+    opts.styles = opts.styles.split(',')
+
+    profile = fake_upstream.profile_from_args(opts)
+    upstream = fake_upstream.start(0, profile)
+    instance_dir = tempfile.mkdtemp(prefix='tastecheck-bench-')
+    proc, port = start_server(opts, upstream.server_port, instance_dir)
+    sampler = RssSampler(proc.pid)
+    sampler.start()
+
+    workload = Workload(opts)
+    results = []
+
+    def one(_):
+        kind, path, body = workload.next()
+        latency, ok = send(port, path, body)
+        results.append((kind, latency, ok))
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts.concurrency) as pool:
+            list(pool.map(one, range(opts.requests)))
+        elapsed = time.perf_counter() - start
+        if opts.metrics:
+            time.sleep(1.5)  # let every worker flush its snapshot
+            scrape_metrics(port, opts.metrics)
+    finally:
+        sampler.stop.set()
+        sampler.join()
+        proc.terminate()
+        proc.wait()
+        upstream.shutdown()
+
+    report(results, elapsed, sampler, profile)
+
+
+if __name__ == '__main__':
+    main()
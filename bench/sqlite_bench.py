@@ -0,0 +1,114 @@
+"""
+Concurrent read/write throughput of tastecheck.db, default vs tuned settings.
+
+Emulates several gunicorn workers (processes), each with reader threads
+doing the login / status lookups and a writer thread doing usage updates.
+
+    python bench/sqlite_bench.py [--workers 4] [--seconds 5] [--users 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from sqlalchemy import create_engine, insert, select, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import db, User, configure_sqlite  # noqa: E402
+
+
+def make_engine(path, tuned):
+    engine = create_engine(f'sqlite:///{path}', pool_size=8, max_overflow=8)
+    if tuned:
+        configure_sqlite(engine)
+    return engine
+
+
+def setup(path, users, tuned):
+    engine = make_engine(path, tuned)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'email': f'user{i}@example.com', 'password_hash': 'x', 'created_at': datetime.utcnow()}
+            for i in range(users)
+        ])
+    engine.dispose()
+
+
+def worker(args):
+    path, tuned, seconds, users, readers = args
+    engine = make_engine(path, tuned)
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def read_loop(seed):
+        n = seed
+        while time.time() < deadline:
+            n = (n * 7919 + 1) % users
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select(User).where(User.email == f'user{n}@example.com')).first()
+                    conn.execute(select(User).where(User.id == n + 1)).first()
+                with lock:
+                    counts['reads'] += 2
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+
+    def write_loop(seed):
+        n = seed
+        while time.time() < deadline:
+            n = (n * 104729 + 3) % users
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        update(User).where(User.id == n + 1)
+                        .values(analyses_today=User.analyses_today + 1, last_analysis_date=datetime.utcnow().date())
+                    )
+                with lock:
+                    counts['writes'] += 1
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+
+    threads = [threading.Thread(target=read_loop, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=write_loop, args=(os.getpid(),)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    return counts
+
+
+def run(tuned, opts):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    setup(path, opts.users, tuned)
+    with Pool(opts.workers) as pool:
+        results = pool.map(worker, [(path, tuned, opts.seconds, opts.users, opts.readers)] * opts.workers)
+    total = {k: sum(r[k] for r in results) for k in results[0]}
+    label = 'tuned  ' if tuned else 'default'
+    print(f"{label}  reads/s {total['reads'] / opts.seconds:9.0f}   "
+          f"writes/s {total['writes'] / opts.seconds:7.0f}   errors {total['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=3, help='reader threads per worker')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=2000)
+    opts = parser.parse_args()
+
+    run(False, opts)
+    run(True, opts)
+
+
+if __name__ == '__main__':
+    main()
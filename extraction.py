@@ -0,0 +1,78 @@
+"""
+Structured extraction of listening data from a recap screenshot.
+
+The vision model reads each screenshot once into a small JSON record; the
+style-specific scoring and prose are then produced by text-only calls over
+those records, so style switches never re-pay for the image.
+"""
+
+import json
+
+# Bump when the prompt or record shape changes so cached records are not reused
+EXTRACT_VERSION = 1
+
+RECORD_FIELDS = {
+    'service': None,
+    'year': None,
+    'minutes_listened': None,
+    'top_artists': [],
+    'top_songs': [],
+    'genres': [],
+    'notes': '',
+}
+
+EXTRACT_PROMPT = """Read this music streaming recap/wrapped screenshot and extract what it shows.
+
+Reply with ONLY a JSON object, no other text, using exactly these keys:
+{
+  "service": "Spotify, Apple Music, YouTube Music, etc., or null",
+  "year": "the recap year as a number, or null",
+  "minutes_listened": "total minutes as a number, or null",
+  "top_artists": ["artists in ranked order"],
+  "top_songs": ["'Song - Artist' in ranked order"],
+  "genres": ["genres shown or clearly implied"],
+  "notes": "anything else notable (personality type, top podcast, listening age, etc.)"
+}
+
+Only include what is actually visible. Use null or [] for anything missing."""
+
+
+class ExtractionError(Exception):
+    """One or more screenshots in a multi-image analysis could not be read"""
+
+    def __init__(self, failures, labels=None):
+        self.failures = failures  # {index: exception}
+        labels = labels or [f"screenshot {i + 1}" for i in range(max(failures) + 1)]
+        details = '; '.join(f"{labels[i]}: {e}" for i, e in sorted(failures.items()))
+        super().__init__(f"Couldn't read {details}")
+
+
+def parse_extraction(response_text):
+    """Parse the model's JSON reply into a record with every field present.
+
+    Raises ValueError if the reply holds no JSON object (a refusal, or "I
+    can't read this image"), so it is never cached as a record.
+    """
+    record = dict(RECORD_FIELDS)
+    start = response_text.find('{')
+    end = response_text.rfind('}')
+    try:
+        parsed = json.loads(response_text[start:end + 1]) if start != -1 and end != -1 else None
+    except ValueError:
+        parsed = None
+    if not isinstance(parsed, dict):
+        print(f"Unparseable extraction reply: {response_text.strip()[:200]}")
+        raise ValueError("it doesn't look like a music recap")
+
+    for key, default in RECORD_FIELDS.items():
+        value = parsed.get(key, default)
+        if isinstance(default, list) and not isinstance(value, list):
+            value = [value] if value else []
+        record[key] = value
+    return record
+
+
+def format_record(record, label=None):
+    """Render one record as compact text for a render prompt"""
+    heading = f"{label}:\n" if label else ''
+    return heading + json.dumps(record, indent=2, ensure_ascii=False)
@@ -0,0 +1,66 @@
+"""
+Screenshot normalization before images are sent to the vision model.
+
+Decodes each upload, applies EXIF rotation, downscales to a maximum edge,
+drops metadata and re-encodes as JPEG or WebP. Pillow is required for
+this; HEIC input additionally needs pillow-heif. Without Pillow the
+original bytes are passed through untouched.
+"""
+
+import io
+import math
+from collections import namedtuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+PreparedImage = namedtuple(
+    'PreparedImage', 'data media_type width height original_bytes estimated_tokens'
+)
+
+# The API bills roughly one token per 750 pixels
+PIXELS_PER_TOKEN = 750
+
+
+def estimate_image_tokens(width, height):
+    """Approximate input tokens the vision model charges for an image"""
+    return math.ceil(width * height / PIXELS_PER_TOKEN)
+
+
+def normalize_image(image_bytes, max_edge=1568, output_format='JPEG', quality=82):
+    """Downscale and re-encode an image; returns a PreparedImage"""
+    if Image is None:
+        return PreparedImage(image_bytes, None, 0, 0, len(image_bytes), 0)
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = ImageOps.exif_transpose(img)
+
+        if img.mode not in ('RGB', 'L'):
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.split()[-1])
+
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        out = io.BytesIO()
+        # Saving without exif/icc arguments drops the original metadata
+        img.save(out, format=output_format, quality=quality, optimize=True)
+        width, height = img.size
+
+    return PreparedImage(
+        out.getvalue(),
+        'image/webp' if output_format.upper() == 'WEBP' else 'image/jpeg',
+        width,
+        height,
+        len(image_bytes),
+        estimate_image_tokens(width, height),
+    )
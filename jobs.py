@@ -0,0 +1,182 @@
+"""
+Background analysis jobs.
+
+A job runs on a small thread pool in the worker process that accepted it,
+so slow vision calls no longer pin a request thread, and the pool size
+bounds concurrency against the upstream API independently of the web
+server. Job state (status, progress stage, result or error) lives in SQLite
+so every gunicorn worker can answer GET /jobs/<id>, and finished results
+survive a worker restart. A job whose worker died before finishing is
+reported as interrupted.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_local import LocalConnections
+
+QUEUED, RUNNING, DONE, ERROR = 'queued', 'running', 'done', 'error'
+
+# Trim finished jobs once every this many submissions
+PRUNE_EVERY = 200
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """Job rows in a SQLite file shared by every worker"""
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._connections = LocalConnections(path, autocommit=True)
+
+        conn = self._connections.get()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                stage TEXT,
+                result TEXT,
+                error TEXT,
+                pid INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)')
+
+    def create(self):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connections.get().execute(
+            'INSERT INTO jobs (id, status, stage, pid, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, QUEUED, QUEUED, os.getpid(), now, now),
+        )
+        return job_id
+
+    def update(self, job_id, status=None, stage=None, result=None, error=None):
+        fields = {'updated_at': time.time()}
+        if status is not None:
+            fields['status'] = status
+        if stage is not None:
+            fields['stage'] = stage
+        if result is not None:
+            fields['result'] = json.dumps(result)
+        if error is not None:
+            fields['error'] = json.dumps(error)
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._connections.get().execute(
+            f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id)
+        )
+
+    def get(self, job_id):
+        """The job as a dict, or None if unknown or expired"""
+        row = self._connections.get().execute(
+            'SELECT id, status, stage, result, error, pid, created_at, updated_at FROM jobs WHERE id = ?',
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            'id': row[0], 'status': row[1], 'stage': row[2],
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': json.loads(row[4]) if row[4] else None,
+            'created_at': row[6], 'updated_at': row[7],
+        }
+        if job['status'] in (QUEUED, RUNNING) and not pid_alive(row[5]):
+            job['error'] = {'error': 'The analysis was interrupted, please try again'}
+            job['status'] = job['stage'] = ERROR
+            self.update(job_id, status=ERROR, stage=ERROR, error=job['error'])
+        return job
+
+    def prune(self):
+        self._connections.get().execute(
+            'DELETE FROM jobs WHERE created_at < ? AND status IN (?, ?)',
+            (time.time() - self.ttl, DONE, ERROR),
+        )
+
+
+class JobQueue:
+    """Bounded thread pool that runs jobs and records their progress in a JobStore"""
+
+    def __init__(self, store, workers=4, max_pending=64, context=None, describe_error=None):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.context = context
+        self.describe_error = describe_error or (lambda e: {'error': str(e)})
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = 0
+        self._submitted = 0
+        self._pool = None
+        self._pid = None
+
+    def submit(self, fn):
+        """Queue fn() as a job; returns the job id, or None if the queue is full"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+            self._submitted += 1
+            prune = self._submitted % PRUNE_EVERY == 0
+            # gunicorn forks after import, so each worker builds its own pool
+            if self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+                self._pid = os.getpid()
+
+        try:
+            job_id = self.store.create()
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        if prune:
+            self.store.prune()
+        self._pool.submit(self._run, job_id, fn)
+        return job_id
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def report(self, stage):
+        """Record a progress stage for the job running on this thread, if any"""
+        job_id = getattr(self._local, 'job_id', None)
+        if job_id is not None:
+            self.store.update(job_id, stage=stage)
+
+    def _run(self, job_id, fn):
+        self._local.job_id = job_id
+        try:
+            self.store.update(job_id, status=RUNNING, stage=RUNNING)
+            if self.context is not None:
+                with self.context():
+                    result = fn()
+            else:
+                result = fn()
+            self.store.update(job_id, status=DONE, stage=DONE, result=result)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            try:
+                self.store.update(job_id, status=ERROR, stage=ERROR, error=self.describe_error(e))
+            except Exception as store_error:
+                print(f"Job {job_id} state lost: {store_error}")
+        finally:
+            self._local.job_id = None
+            with self._lock:
+                self._pending -= 1
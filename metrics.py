@@ -0,0 +1,267 @@
+"""
+Lightweight request, stage and upstream metrics in the Prometheus text format.
+
+Disabled by default: every recording call checks one flag and returns, and
+stage() hands back a shared no-op context manager, so the hot path pays a
+function call and nothing else.
+
+When enabled, each process keeps its own counters, gauges and histograms
+in memory and writes a JSON snapshot to a shared directory every few
+seconds. /metrics merges the snapshots of all live worker processes, so a
+scrape of any gunicorn worker sees the whole server. Snapshots of dead
+workers are removed; Prometheus treats the resulting drop as a counter
+reset.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+NO_STAGE = nullcontext()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """One metric family; series are keyed by a tuple of label values"""
+
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+
+    def snapshot(self):
+        return {
+            'kind': self.kind, 'help': self.help, 'labelnames': list(self.labelnames),
+            'series': [[list(labels), value] for labels, value in self.series.items()],
+        }
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        """Overwrite with a total counted elsewhere (see Metrics.add_collector)"""
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self.series[labels] = value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+class Stage:
+    """Times a `with` block into a histogram"""
+
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Metrics:
+    """Registry of metric families for this process"""
+
+    def __init__(self, enabled=False, directory=None, flush_interval=5):
+        self.enabled = enabled
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.families = {}
+        self.collectors = []
+        self._flusher = None
+        self._pid = None
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help, labelnames, buckets))
+
+    def _add(self, family):
+        self.families[family.name] = family
+        return family
+
+    def add_collector(self, collect):
+        """Call collect() before every snapshot, to copy in totals kept elsewhere"""
+        self.collectors.append(collect)
+
+    def stage(self, histogram, *labels):
+        """Context manager timing a block into histogram; a no-op when disabled"""
+        if not self.enabled:
+            return NO_STAGE
+        return Stage(histogram, labels)
+
+    def start(self):
+        """Begin periodic snapshots in this process (call lazily, e.g. per request)"""
+        if not self.enabled or not self.directory or self._pid == os.getpid():
+            return
+        # gunicorn forks workers after import, so each worker starts its own flusher
+        self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Metrics flush error: {e}")
+
+    def snapshot(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        with self.lock:
+            return {name: family.snapshot() for name, family in self.families.items()}
+
+    def flush(self):
+        """Write this process's snapshot where other workers can merge it"""
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def gather(self):
+        """Snapshots of every live worker, this one freshest"""
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+        snapshots = []
+        for entry in os.listdir(self.directory):
+            if not entry.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, entry)
+            try:
+                pid = int(entry[:-5])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except (ValueError, PermissionError):
+                pass
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """All live workers' metrics, summed, in the Prometheus text format"""
+        merged = {}
+        for snapshot in self.gather():
+            for name, family in snapshot.items():
+                target = merged.setdefault(name, dict(family, series={}))
+                for labels, value in family['series']:
+                    key = tuple(labels)
+                    current = target['series'].get(key)
+                    if current is None:
+                        target['series'][key] = value
+                    elif family['kind'] == 'histogram':
+                        target['series'][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target['series'][key] = current + value
+
+        lines = []
+        for name in sorted(merged):
+            family = merged[name]
+            names = family['labelnames']
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for labels, value in sorted(family['series'].items()):
+                if family['kind'] != 'histogram':
+                    lines.append(f"{name}{_format_labels(names, labels)} {_format_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(family['buckets']) + [float('inf')], value):
+                    cumulative += count
+                    le = f'le="{_format_number(float(bound))}"'
+                    lines.append(f"{name}_bucket{_format_labels(names, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(names, labels)} {_format_number(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(names, labels)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
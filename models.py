@@ -1,20 +1,56 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+import threading
+import time
+from sqlalchemy import update, case, func, or_, event
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 db = SQLAlchemy()
 
+# Applied to every new SQLite connection (see configure_sqlite)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',      # readers no longer block behind the writer
+    'synchronous': 'NORMAL',    # safe with WAL, far fewer fsyncs
+    'busy_timeout': 5000,       # wait for the write lock instead of failing
+    'cache_size': -20000,       # ~20 MB page cache per connection
+    'temp_store': 'MEMORY',
+}
+
+
+def configure_sqlite(engine, pragmas=SQLITE_PRAGMAS):
+    """Set the SQLite pragmas on each connection the engine opens"""
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def ensure_indexes():
+    """Create any model indexes missing from an existing database.
+    
+    db.create_all() only creates indexes for brand new tables.
+    """
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     is_premium = db.Column(db.Boolean, default=False)
     is_admin = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Usage tracking
     analyses_today = db.Column(db.Integer, default=0)
-    last_analysis_date = db.Column(db.Date, default=datetime.utcnow().date)
+    last_analysis_date = db.Column(db.Date, default=datetime.utcnow().date, index=True)
     
     def get_daily_limit(self):
         if self.is_admin:
@@ -24,16 +60,136 @@ class User(UserMixin, db.Model):
         else:
             return 10  # Free users
     
-    def can_analyze(self):
-        # Reset counter if new day
+    def analyses_used_today(self):
         today = datetime.utcnow().date()
         if self.last_analysis_date != today:
-            self.analyses_today = 0
-            self.last_analysis_date = today
-            db.session.commit()
+            return 0
+        return self.analyses_today or 0
+    
+    def can_analyze(self):
+        # Read-only: the date rollover happens inside reserve_analysis()
+        return self.analyses_used_today() < self.get_daily_limit()
+    
+    def reserve_analysis(self):
+        """Atomically check the daily limit and take one analysis.
+        
+        A single conditional UPDATE resets the counter on a new day and
+        increments it, so concurrent requests can neither lose increments
+        nor overshoot the limit. Returns True if the analysis was reserved.
+        """
+        # Read before commit() expires the instance, which would reload it
+        user_id = self.id
+        today = datetime.utcnow().date()
+        is_today = User.last_analysis_date == today
+        stmt = (
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                analyses_today=case((is_today, func.coalesce(User.analyses_today, 0) + 1), else_=1),
+                last_analysis_date=today,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        limit = self.get_daily_limit()
+        if limit != float('inf'):
+            stmt = stmt.where(or_(~is_today, User.last_analysis_date.is_(None), User.analyses_today < limit))
         
-        return self.analyses_today < self.get_daily_limit()
+        reserved = db.session.execute(stmt).rowcount == 1
+        db.session.commit()
+        user_cache.invalidate(user_id)
+        return reserved
+    
+    def release_analysis(self):
+        """Give back a reservation whose analysis failed"""
+        user_id = self.id
+        today = datetime.utcnow().date()
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id, User.last_analysis_date == today, User.analyses_today > 0)
+            .values(analyses_today=User.analyses_today - 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        user_cache.invalidate(user_id)
     
     def increment_usage(self):
-        self.analyses_today += 1
+        user_id = self.id
+        today = datetime.utcnow().date()
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                analyses_today=case(
+                    (User.last_analysis_date == today, func.coalesce(User.analyses_today, 0) + 1), else_=1
+                ),
+                last_analysis_date=today,
+            )
+            .execution_options(synchronize_session=False)
+        )
         db.session.commit()
+        user_cache.invalidate(user_id)
+
+
+class UserCache:
+    """Short-lived per-process cache of User rows for the login loader.
+    
+    Only plain column values are cached; each hit is re-attached to the
+    current session with merge(load=False), which issues no query. Entries
+    are dropped once a change to a User commits, whether through the ORM or
+    the usage counters, and expire after ttl seconds regardless, which
+    bounds staleness for changes made by other worker processes.
+    """
+    
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a load that raced one isn't cached
+        self._generation = 0
+    
+    def load(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            user = User(**entry[1])
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        
+        with self._lock:
+            generation = self._generation
+        user = db.session.get(User, user_id)
+        if user is not None and self.ttl > 0:
+            values = {c.key: getattr(user, c.key) for c in User.__table__.columns}
+            with self._lock:
+                if self._generation == generation:
+                    self._entries[user_id] = (time.monotonic() + self.ttl, values)
+        return user
+    
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+
+# Invalidate on commit, not at flush time: between the two, another thread
+# could load the old committed row and cache it for the whole ttl
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_user_ids', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cached_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
@@ -0,0 +1,87 @@
+"""
+Turn a generated podcast script into a minimal list of TTS jobs.
+
+The 'podcast' prompt produces lines like "ALEX: ..." / "JORDAN: ...", but
+the model also wraps long turns onto unprefixed lines and likes short
+interjections ("ALEX: Hmm."). One TTS call per line pays the per-call
+overhead for every one of those, and dropped continuation lines lose words.
+
+segment_script() instead:
+
+- recognises speaker tags with markdown around them ("**ALEX:**");
+- appends unprefixed lines to the turn they continue;
+- merges adjacent turns spoken by the same voice;
+- splits turns longer than the TTS input limit on sentence boundaries
+  (then on spaces, for a single runaway sentence).
+"""
+
+import re
+
+# OpenAI TTS rejects inputs longer than this
+MAX_INPUT_CHARS = 4096
+
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def speaker_pattern(voices):
+    """Regex matching a leading speaker tag, allowing markdown emphasis around it"""
+    names = '|'.join(re.escape(speaker.rstrip(':')) for speaker in voices)
+    return re.compile(rf'^[*_\s]*({names})[*_\s]*:[*_\s]*')
+
+
+def segment_script(dialogue_text, voices, max_chars=MAX_INPUT_CHARS):
+    """Ordered (voice, text) jobs for a script; voices maps speaker tag -> voice"""
+    tag = speaker_pattern(voices)
+    turns = []
+    for line in dialogue_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = tag.match(line)
+        if match:
+            voice = voices[match.group(1) + ':']
+            text = line[match.end():].strip()
+            if turns and turns[-1][0] == voice:
+                turns[-1][1].append(text)
+            else:
+                turns.append((voice, [text]))
+        elif turns:
+            # A wrapped continuation of the current turn; text before the
+            # first speaker (a title, "Here's the script:") is not spoken
+            turns[-1][1].append(line)
+
+    segments = []
+    for voice, parts in turns:
+        text = ' '.join(part for part in parts if part)
+        for chunk in split_text(text, max_chars):
+            segments.append((voice, chunk))
+    return segments
+
+
+def split_text(text, max_chars):
+    """Split text into chunks of at most max_chars, preferring sentence ends"""
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    chunks = []
+    current = ''
+    for sentence in SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(sentence[:cut].rstrip())
+            sentence = sentence[cut:].lstrip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
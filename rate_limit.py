@@ -1,25 +1,119 @@
-from datetime import datetime, timedelta
-from collections import defaultdict
+import os
+import threading
+import time
+
+from sqlite_local import LocalConnections
+
+# Guests get 3 analyses, refilled continuously over a day (token bucket)
+GUEST_DAILY_LIMIT = int(os.environ.get('GUEST_DAILY_LIMIT', 3))
+REFILL_PER_SECOND = GUEST_DAILY_LIMIT / (24 * 3600)
+
+# Shared by every worker process, next to tastecheck.db
+DB_PATH = os.environ.get(
+    'RATE_LIMIT_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'rate_limit.db'),
+)
+
+# SQL expression for a bucket's level at time :now
+REFILLED = 'MIN(:cap, tokens + (:now - updated_at) * :rate)'
+
+# Drop fully refilled buckets once every this many writes
+EVICT_EVERY = 500
+
+
+class GuestLimiter:
+    """Token-bucket limiter stored in SQLite so all gunicorn workers share counts.
+
+    Each key is one row; a check is a single indexed read and a
+    check-and-increment is a single conditional UPSERT. Rows whose bucket has
+    refilled completely carry no information and are evicted periodically.
+    """
+
+    def __init__(self, path, capacity=GUEST_DAILY_LIMIT, refill_rate=REFILL_PER_SECOND):
+        self.path = path
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._connections = LocalConnections(path, autocommit=True)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        conn = self._connections.get()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS guest_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_guest_updated ON guest_buckets (updated_at)')
+
+    def remaining(self, key):
+        """Whole analyses left for key right now"""
+        row = self._connections.get().execute(
+            f'SELECT {REFILLED} FROM guest_buckets WHERE key = :key',
+            self._params(key),
+        ).fetchone()
+        return int(row[0]) if row else self.capacity
+
+    def consume(self, key, only_if_available=True):
+        """Take one token; returns False (and takes nothing) if the bucket is empty"""
+        condition = f'WHERE {REFILLED} >= 1' if only_if_available else ''
+        cursor = self._connections.get().execute(
+            f"""INSERT INTO guest_buckets (key, tokens, updated_at)
+                VALUES (:key, :cap - 1, :now)
+                ON CONFLICT(key) DO UPDATE SET
+                    tokens = MAX({REFILLED} - 1, 0),
+                    updated_at = :now
+                {condition}""",
+            self._params(key),
+        )
+        # Request threads each have their own connection, so consume() runs concurrently
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+        return cursor.rowcount == 1
+
+    def refund(self, key):
+        """Put back a token taken for an analysis that failed"""
+        self._connections.get().execute(
+            'UPDATE guest_buckets SET tokens = MIN(:cap, tokens + 1) WHERE key = :key',
+            self._params(key),
+        )
+
+    def evict(self):
+        """Delete buckets that have refilled completely"""
+        full_after = self.capacity / self.refill_rate
+        self._connections.get().execute(
+            'DELETE FROM guest_buckets WHERE updated_at < ?', (time.time() - full_after,)
+        )
+
+    def _params(self, key):
+        return {'key': key, 'cap': self.capacity, 'rate': self.refill_rate, 'now': time.time()}
+
+
+guest_limiter = GuestLimiter(DB_PATH)
 
-# Simple in-memory rate limiter for guests
-guest_usage = defaultdict(lambda: {'count': 0, 'reset_time': datetime.utcnow() + timedelta(days=1)})
 
 def check_guest_limit(ip_address):
     """Check if guest IP has reached daily limit (3 analyses)"""
-    now = datetime.utcnow()
-    user_data = guest_usage[ip_address]
-    
-    # Reset if past reset time
-    if now > user_data['reset_time']:
-        user_data['count'] = 0
-        user_data['reset_time'] = now + timedelta(days=1)
-    
-    # Check limit
-    if user_data['count'] >= 3:
+    remaining = guest_limiter.remaining(ip_address)
+    if remaining < 1:
         return False, 0
-    
-    return True, 3 - user_data['count']
+    return True, remaining
+
 
 def increment_guest_usage(ip_address):
     """Increment guest usage count"""
-    guest_usage[ip_address]['count'] += 1
+    guest_limiter.consume(ip_address, only_if_available=False)
+
+
+def try_guest_usage(ip_address):
+    """Atomically check and increment in one statement; True if allowed"""
+    return guest_limiter.consume(ip_address)
+
+
+def release_guest_usage(ip_address):
+    """Undo try_guest_usage for an analysis that failed"""
+    guest_limiter.refund(ip_address)
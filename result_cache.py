@@ -0,0 +1,146 @@
+"""
+Content-addressed cache for analysis results.
+
+Two tiers: a small in-memory LRU per process, backed by a SQLite file that
+is shared by every worker. Entries expire after a TTL and the disk tier is
+trimmed back to a maximum number of rows, least recently used first.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_local import LocalConnections
+
+
+def make_key(*parts, images=()):
+    """Build a cache key from raw image bytes plus any number of text fields"""
+    h = hashlib.sha256()
+    for image_bytes in images:
+        h.update(hashlib.sha256(image_bytes).digest())
+    for part in parts:
+        h.update(b'\x00')
+        h.update(str(part).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + SQLite) cache of JSON-serialisable results"""
+
+    # Trim the disk tier once every this many writes
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, memory_size=256, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connections = LocalConnections(path)
+        self._writes = 0
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        with self._connections.get() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)')
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+
+        try:
+            conn = self._connections.get()
+            row = conn.execute(
+                'SELECT value, created_at FROM results WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                with conn:
+                    conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+                value = json.loads(row[0])
+                self._remember(key, row[1], value)
+                with self._lock:
+                    self.hits_disk += 1
+                return value
+        except sqlite3.Error as e:
+            print(f"Cache read error: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Store value under key in both tiers"""
+        now = time.time()
+        self._remember(key, now, value)
+
+        try:
+            conn = self._connections.get()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                    (key, json.dumps(value), now, now),
+                )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % self.PRUNE_EVERY == 0
+            if prune:
+                self.prune()
+        except sqlite3.Error as e:
+            print(f"Cache write error: {e}")
+
+    def prune(self):
+        """Drop expired rows, then the least recently used rows over max_entries"""
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM results WHERE created_at < ?', (time.time() - self.ttl,))
+            conn.execute(
+                """DELETE FROM results WHERE key IN (
+                    SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk
+            total = hits + self.misses
+            return {
+                'hits_memory': self.hits_memory,
+                'hits_disk': self.hits_disk,
+                'misses': self.misses,
+                'hit_rate': hits / total if total else 0.0,
+                'memory_entries': len(self._memory),
+            }
+
+    def _remember(self, key, created_at, value):
+        with self._lock:
+            self._memory[key] = (created_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
@@ -0,0 +1,67 @@
+"""
+Per-mode model routing.
+
+A route names the models that serve a call (the primary first, then
+fallbacks tried in order when a model times out), how many tokens it may
+produce and how long to wait for it. Routes are looked up by "mode/style",
+then "mode", then "default", so traffic can be moved between tiers from
+config alone. MODEL_ROUTES holds overrides as JSON, or a path to a JSON
+file; each entry only needs the fields it changes:
+
+    MODEL_ROUTES='{"manual": {"models": ["claude-3-5-haiku-20241022"]}, "single/podcast": {"max_tokens": 2048}}'
+"""
+
+import json
+from collections import namedtuple
+
+SMART_MODEL = "claude-sonnet-4-20250514"
+FAST_MODEL = "claude-3-5-haiku-20241022"
+
+Route = namedtuple('Route', 'name models max_tokens timeout')
+
+DEFAULT_ROUTES = {
+    'default': {'models': [SMART_MODEL, FAST_MODEL], 'max_tokens': 1024, 'timeout': 60},
+    # Stage 1 screenshot reading (vision)
+    'extract': {'models': [SMART_MODEL, FAST_MODEL], 'max_tokens': 600, 'timeout': 30},
+    'single': {'models': [SMART_MODEL, FAST_MODEL], 'max_tokens': 1024, 'timeout': 60},
+    'evolution': {'models': [SMART_MODEL, FAST_MODEL], 'max_tokens': 1500, 'timeout': 90},
+    'battle': {'models': [SMART_MODEL, FAST_MODEL], 'max_tokens': 1500, 'timeout': 90},
+    # Six short form fields: the fast tier is plenty
+    'manual': {'models': [FAST_MODEL, SMART_MODEL], 'max_tokens': 1024, 'timeout': 20},
+}
+
+
+def load_overrides(value):
+    """Parse MODEL_ROUTES: inline JSON, a path to a JSON file, or empty"""
+    value = (value or '').strip()
+    if not value:
+        return {}
+    if not value.startswith('{'):
+        with open(value) as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+class Router:
+    """Resolves (mode, style) to a Route"""
+
+    def __init__(self, overrides=None):
+        specs = {name: dict(spec) for name, spec in DEFAULT_ROUTES.items()}
+        for name, spec in (overrides or {}).items():
+            # A new key inherits from its mode's route, e.g. "single/podcast" from "single"
+            base = specs.get(name) or specs.get(name.split('/')[0]) or specs['default']
+            specs[name] = dict(base, **spec)
+
+        self.routes = {}
+        for name, spec in specs.items():
+            models = spec['models']
+            if isinstance(models, str):
+                models = [models]
+            if not models:
+                raise ValueError(f"Route {name} has no models")
+            self.routes[name] = Route(name, tuple(models), int(spec['max_tokens']), float(spec['timeout']))
+
+    def route(self, mode, style=''):
+        return (self.routes.get(f"{mode}/{style}")
+                or self.routes.get(mode)
+                or self.routes['default'])
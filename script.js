@@ -237,65 +237,106 @@ async function analyze() {
     document.getElementById('loading').scrollIntoView({ behavior: 'smooth', block: 'nearest' });
     
     try {
-        let requestBody = {
-            mode: currentMode,
-            style: selectedStyle
-        };
+        let fetchOptions;
         
         if (currentMode === 'manual') {
-            requestBody.answers = manualAnswers;
-            requestBody.userName = userName;
+            const requestBody = {
+                mode: currentMode,
+                style: selectedStyle,
+                answers: manualAnswers,
+                userName: userName
+            };
+            console.log('Sending request:', requestBody);
+            fetchOptions = {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(requestBody)
+            };
         } else {
-            // Convert files to base64
-            const images = [];
+            // Upload screenshots as raw file fields rather than base64 JSON
+            const formData = new FormData();
+            formData.append('mode', currentMode);
+            formData.append('style', selectedStyle);
             for (const file of uploadedFiles) {
                 if (file) {
-                    const base64 = await fileToBase64(file);
-                    images.push(base64);
+                    formData.append('images', file);
                 }
             }
-            requestBody.images = images;
             
             if (currentMode === 'battle') {
-                requestBody.nameA = battleNames.nameA;
-                requestBody.nameB = battleNames.nameB;
+                formData.append('nameA', battleNames.nameA);
+                formData.append('nameB', battleNames.nameB);
             } else {
-                requestBody.userName = userName;
+                formData.append('userName', userName);
             }
+            console.log('Sending request:', currentMode, selectedStyle);
+            fetchOptions = { method: 'POST', body: formData };
         }
         
-        console.log('Sending request:', requestBody);
-        
-        const response = await fetch('/analyze', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(requestBody)
-        });
+        const response = await fetch('/analyze/stream', fetchOptions);
         
+        if (response.status === 429) {
+            const error = new Error('Daily limit reached');
+            error.userMessage = "You've used all your analyses for today. Come back tomorrow!";
+            throw error;
+        }
         if (!response.ok) {
             throw new Error('Analysis failed');
         }
         
-        const data = await response.json();
-        console.log('Got response:', data);
-        displayResults(data);
+        // Show the score as soon as it arrives, then fill in the analysis
+        let shownEarly = false;
+        await readEventStream(response, (event, data) => {
+            if (event === 'score') {
+                displayResults({ ...data, analysis: '' });
+                shownEarly = true;
+            } else if (event === 'analysis') {
+                document.getElementById('analysisText').textContent += data.text;
+            } else if (event === 'done') {
+                console.log('Got response:', data);
+                if (shownEarly) {
+                    document.getElementById('analysisText').textContent = data.analysis;
+                } else {
+                    displayResults(data);
+                }
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            }
+        });
         
     } catch (error) {
         console.error('Error:', error);
-        alert('Something went wrong. Please try again.');
+        alert(error.userMessage || 'Something went wrong. Please try again.');
         hideLoadingProgress();
         document.getElementById('loading').style.display = 'none';
     }
 }
 
-// Convert file to base64
-function fileToBase64(file) {
-    return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onload = () => resolve(reader.result.split(',')[1]);
-        reader.onerror = reject;
-        reader.readAsDataURL(file);
-    });
+// Read a text/event-stream response, calling onEvent(event, data) per event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            onEvent(event, data ? JSON.parse(data) : null);
+        }
+    }
 }
 
 // Display results
@@ -478,23 +519,26 @@ async function generatePodcastAudio(dialogue) {
     audioBtn.disabled = true;
     
     try {
-        const response = await fetch('/generate_audio', {
+        const response = await fetch('/generate_audio/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ dialogue: dialogue })
         });
         
-        const data = await response.json();
+        if (!response.ok) {
+            throw new Error('Audio generation failed');
+        }
         
-        if (data.audio) {
-            // Convert base64 to audio
-            const audioBlob = base64ToBlob(data.audio, 'audio/mpeg');
-            const audioUrl = URL.createObjectURL(audioBlob);
-            
-            audioPlayer.src = audioUrl;
-            audioPlayer.style.display = 'block';
-            audioBtn.style.display = 'none';
+        if (window.MediaSource && MediaSource.isTypeSupported('audio/mpeg')) {
+            // Start playback on the first lines while the rest are generated
+            audioPlayer.src = URL.createObjectURL(streamToMediaSource(response.body));
+        } else {
+            const audioBlob = await response.blob();
+            audioPlayer.src = URL.createObjectURL(audioBlob);
         }
+        
+        audioPlayer.style.display = 'block';
+        audioBtn.style.display = 'none';
     } catch (error) {
         console.error('Audio generation error:', error);
         audioBtn.textContent = '❌ Audio failed';
@@ -502,13 +546,25 @@ async function generatePodcastAudio(dialogue) {
     }
 }
 
-function base64ToBlob(base64, type) {
-    const binary = atob(base64);
-    const array = new Uint8Array(binary.length);
-    for (let i = 0; i < binary.length; i++) {
-        array[i] = binary.charCodeAt(i);
-    }
-    return new Blob([array], { type: type });
+// Feed a streamed audio/mpeg body into a MediaSource chunk by chunk
+function streamToMediaSource(body) {
+    const mediaSource = new MediaSource();
+    
+    mediaSource.addEventListener('sourceopen', async () => {
+        const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+        sourceBuffer.mode = 'sequence';
+        const reader = body.getReader();
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            sourceBuffer.appendBuffer(value);
+            await new Promise(resolve => sourceBuffer.addEventListener('updateend', resolve, { once: true }));
+        }
+        mediaSource.endOfStream();
+    }, { once: true });
+    
+    return mediaSource;
 }
 
 
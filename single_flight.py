@@ -0,0 +1,60 @@
+"""
+In-process request coalescing ("single flight").
+
+The first caller for a key does the work; callers that arrive with the
+same key while it is running wait for its result (or exception) instead of
+repeating it. Once the work finishes the key is forgotten, so later callers
+go through the normal caches.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def begin(self, key):
+        """Return (future, leader). A leader must call finish(key, ...) exactly once"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def pending(self, key):
+        """The future for key if a call is already in flight, else None"""
+        with self._lock:
+            return self._calls.get(key)
+
+    def finish(self, key, result=None, error=None):
+        """Publish the leader's outcome to every waiter and forget the key"""
+        with self._lock:
+            future = self._calls.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once for all concurrent callers with key; returns (result, leader)"""
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result(), False
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result, True
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,136 @@
+"""
+Content-addressed disk cache for synthesized podcast lines.
+
+Each line's audio is keyed on (model, voice, normalized text), so pressing
+the audio button twice, sharing a podcast or reusing a stock opener costs no
+TTS call. Audio lives in one file per segment under the cache directory; a
+SQLite index shared by every worker tracks sizes and last access, and the
+least recently used segments are deleted once the total passes max_bytes.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+
+from sqlite_local import LocalConnections
+
+# After an eviction, the cache is trimmed to this fraction of max_bytes so
+# that it doesn't evict again on the very next write
+LOW_WATER = 0.9
+
+
+def normalize_text(text):
+    """Collapse whitespace and Unicode variants that don't change the spoken line"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def segment_key(model, voice, text):
+    """Cache key of one line; text should already be normalized"""
+    return hashlib.sha256(f"{model}\x00{voice}\x00{text}".encode('utf-8')).hexdigest()
+
+
+class SpeechCache:
+    """Audio segments on disk with a shared LRU index, capped at max_bytes"""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._connections = LocalConnections(os.path.join(directory, 'index.db'))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        with self._connections.get() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS segments (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_segments_accessed ON segments (accessed_at)')
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def get(self, key):
+        """Return the cached audio for key, or None"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                audio = f.read()
+            with self._connections.get() as conn:
+                conn.execute('UPDATE segments SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            with self._lock:
+                self.hits += 1
+            return audio
+        except FileNotFoundError:
+            pass
+        except (OSError, sqlite3.Error) as e:
+            print(f"Speech cache read error: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, audio):
+        """Store audio under key, evicting old segments if the cache is over size"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so other workers never read half a file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp, path)
+
+            conn = self._connections.get()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO segments (key, size, accessed_at) VALUES (?, ?, ?)',
+                    (key, len(audio), time.time()),
+                )
+                total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM segments').fetchone()[0]
+            if total > self.max_bytes:
+                self.evict(total)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Speech cache write error: {e}")
+
+    def evict(self, total):
+        """Delete least recently used segments until under LOW_WATER * max_bytes"""
+        target = self.max_bytes * LOW_WATER
+        victims = []
+        conn = self._connections.get()
+        with conn:
+            for key, size in conn.execute('SELECT key, size FROM segments ORDER BY accessed_at'):
+                if total <= target:
+                    break
+                victims.append(key)
+                total -= size
+            conn.executemany('DELETE FROM segments WHERE key = ?', [(key,) for key in victims])
+
+        for key in victims:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.evictions += len(victims)
+
+    def stats(self):
+        """Hit/miss/eviction counters for this process"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,36 @@
+"""
+Per-thread SQLite connections for the files shared by every worker.
+
+The result caches, guest limiter, job store and speech cache each keep one
+connection per thread (sqlite3 connections can't be shared across threads),
+opened in WAL mode so readers never block the single writer. Connections
+live as long as their thread, so callers should run on long-lived threads
+(request workers, fixed pools) rather than a fresh executor per request.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class LocalConnections:
+    """Lazily opens, then reuses, one WAL-mode connection per thread"""
+
+    def __init__(self, path, autocommit=False, timeout=5):
+        self.path = path
+        self.autocommit = autocommit
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.autocommit:
+                conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            else:
+                conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
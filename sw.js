@@ -1,48 +1,60 @@
-const CACHE_NAME = 'tastecheck-v1';
-const urlsToCache = [
+// Both values are filled in by the server (assets.py) from the content hashes
+const CACHE_VERSION = 'dev';
+const PRECACHE_URLS = [
   '/',
-  '/index.html',
-  '/style.css',
-  '/script.js',
-  '/manifest.json',
-  '/icon-192.png',
-  '/icon-512.png'
+  '/manifest.json'
 ];
 
-// Install service worker and cache assets
+const CACHE_NAME = 'tastecheck-' + CACHE_VERSION;
+
+// Never touch API, streaming or auth traffic
+const BYPASS_PREFIXES = [
+  '/analyze',
+  '/generate_audio',
+  '/jobs',
+  '/metrics',
+  '/auth',
+  '/login',
+  '/logout',
+  '/register',
+  '/user/'
+];
+
+// Hashed filenames (e.g. script.3f2a9c1d.js) never change content
+const HASHED_ASSET = /\.[0-9a-f]{8}\.[a-z0-9]+$/;
+
+// Install the complete new version into its own cache before it can activate
 self.addEventListener('install', event => {
   event.waitUntil(
     caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
-      })
+      .then(cache => Promise.all(PRECACHE_URLS.map(url => precache(cache, url))))
+      .then(() => self.skipWaiting())
   );
 });
 
-// Fetch from cache, fallback to network
-self.addEventListener('fetch', event => {
-  event.respondWith(
-    caches.match(event.request)
-      .then(response => {
-        // Cache hit - return response
-        if (response) {
-          return response;
-        }
-        return fetch(event.request);
+function precache(cache, url) {
+  // Reuse hashed assets from an older version's cache instead of refetching
+  const cached = HASHED_ASSET.test(url) ? caches.match(url) : Promise.resolve(null);
+  return cached.then(response => {
+    if (response) {
+      return cache.put(url, response);
+    }
+    return fetch(url, { cache: 'reload' }).then(response => {
+      if (!response.ok) {
+        throw new Error('Precache failed for ' + url);
       }
-    )
-  );
-});
+      return cache.put(url, response);
+    });
+  });
+}
 
-// Update service worker
+// Switch every open page over to the new version, then drop old caches
 self.addEventListener('activate', event => {
-  const cacheWhitelist = [CACHE_NAME];
   event.waitUntil(
-    caches.keys().then(cacheNames => {
+    self.clients.claim().then(() => caches.keys()).then(cacheNames => {
       return Promise.all(
         cacheNames.map(cacheName => {
-          if (cacheWhitelist.indexOf(cacheName) === -1) {
+          if (cacheName.startsWith('tastecheck-') && cacheName !== CACHE_NAME) {
             return caches.delete(cacheName);
           }
         })
@@ -50,3 +62,69 @@ self.addEventListener('activate', event => {
     })
   );
 });
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+
+  if (request.method !== 'GET' || url.origin !== self.location.origin) {
+    return;
+  }
+  if (BYPASS_PREFIXES.some(prefix => url.pathname.startsWith(prefix))) {
+    return;
+  }
+
+  if (request.mode === 'navigate') {
+    event.respondWith(networkFirst(request));
+  } else if (HASHED_ASSET.test(url.pathname)) {
+    event.respondWith(cacheFirst(request));
+  } else {
+    event.respondWith(staleWhileRevalidate(event, request));
+  }
+});
+
+// The HTML shell must match the assets it references, so prefer the network
+function networkFirst(request) {
+  return fetch(request)
+    .then(response => {
+      if (response.ok && new URL(request.url).pathname === '/') {
+        const copy = response.clone();
+        caches.open(CACHE_NAME).then(cache => cache.put('/', copy));
+      }
+      return response;
+    })
+    .catch(() => caches.match('/'));
+}
+
+function cacheFirst(request) {
+  return caches.match(request).then(cached => {
+    if (cached) {
+      return cached;
+    }
+    return fetch(request).then(response => {
+      if (response.ok) {
+        const copy = response.clone();
+        caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+      }
+      return response;
+    });
+  });
+}
+
+function staleWhileRevalidate(event, request) {
+  return caches.open(CACHE_NAME).then(cache => {
+    return cache.match(request).then(cached => {
+      const network = fetch(request).then(response => {
+        if (response.ok) {
+          cache.put(request, response.clone());
+        }
+        return response;
+      });
+      if (cached) {
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+      }
+      return network;
+    });
+  });
+}
@@ -0,0 +1,28 @@
+from podcast_script import MAX_INPUT_CHARS, segment_script
+
+VOICES = {'ALEX:': 'onyx', 'JORDAN:': 'nova'}
+
+
+def test_markdown_speaker_tags_start_a_turn():
+    script = "**ALEX:** Welcome back.\n__JORDAN__: Hi!\n**ALEX**: Bye."
+    assert segment_script(script, VOICES) == [
+        ('onyx', 'Welcome back.'),
+        ('nova', 'Hi!'),
+        ('onyx', 'Bye.'),
+    ]
+
+
+def test_continuations_and_same_voice_turns_merge():
+    script = "Here's the script:\nALEX: Hello.\nwrapped line\nALEX: Hmm.\nJORDAN: Yo."
+    assert segment_script(script, VOICES) == [
+        ('onyx', 'Hello. wrapped line Hmm.'),
+        ('nova', 'Yo.'),
+    ]
+
+
+def test_long_turns_split_under_the_input_limit():
+    text = ' '.join(f"Sentence number {i} is here." for i in range(400))
+    segments = segment_script("JORDAN: " + text, VOICES)
+    assert len(segments) > 1
+    assert all(len(chunk) <= MAX_INPUT_CHARS for _, chunk in segments)
+    assert ' '.join(chunk for _, chunk in segments) == text
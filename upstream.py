@@ -0,0 +1,264 @@
+"""
+Gateway around an upstream API client (Anthropic, OpenAI).
+
+Every call goes through one Gateway per provider, which gives it:
+
+- a process-wide concurrency cap, so a burst of requests queues here
+  instead of piling onto a provider that is already struggling;
+- a deadline covering the whole call: waiting for a slot, every attempt
+  and every backoff sleep. Each attempt gets the time that is left as its
+  SDK timeout;
+- retries of overloads (429, 5xx/529) and dropped connections with
+  full-jitter exponential backoff. A retry-after from the provider is
+  honoured, and if it points past the deadline the error is raised at once;
+- a circuit breaker per model (callers pass the model as the breaker
+  key). After enough consecutive failures, calls to that model fail fast
+  with CircuitOpen for a cooldown period, after which a single probe call
+  decides whether to close it again. Keeping breakers per model means a
+  primary that keeps timing out doesn't block the fallback model.
+
+Timeouts are not retried here (the router falls back to another model
+instead), but they do count towards the breaker. Once the gateway gives up
+on an overload, dropped connection or timeout, it raises
+UpstreamUnavailable with the provider's error as __cause__, so callers
+answer 503 + Retry-After instead of treating it as a bad reply.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+RETRY_STATUSES = (408, 409, 429)
+
+
+class UpstreamUnavailable(Exception):
+    """The provider is degraded (breaker open) or every slot is busy; try again later"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(error):
+    """Seconds the provider asked us to wait, from retry-after-ms or retry-after"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass  # an HTTP date; fall back to our own backoff
+    return None
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Rejected without calling because this model's breaker is open"""
+
+
+class Breaker:
+    """Circuit state for one model (or for the whole provider, by default)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0
+        self.probing = False
+
+
+class Gateway:
+    """Concurrency cap, deadlines, retries and per-model circuit breakers for one provider"""
+
+    def __init__(self, name, concurrency=16, max_retries=3, base_delay=0.5, max_delay=8,
+                 failure_threshold=5, cooldown=30, connection_errors=(), timeout_errors=()):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.connection_errors = connection_errors
+        self.timeout_errors = timeout_errors
+
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def call(self, fn, timeout, breaker=None):
+        """Return fn(remaining_timeout), retried as described above.
+
+        Calls with different breaker keys (model names) trip independently,
+        so a primary model timing out doesn't block its fallback.
+        """
+        with self.session(fn, timeout, breaker) as result:
+            return result
+
+    @contextmanager
+    def session(self, fn, timeout, breaker=None):
+        """Like call(), but keep the slot until the with block ends (for streamed replies)"""
+        breaker = self._breaker(breaker)
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            probe = self._admit(breaker)
+            self._acquire(deadline, breaker, probe)
+            try:
+                result = fn(max(0.1, deadline - time.monotonic()))
+            except Exception as e:
+                self._release()
+                delay = self._after_failure(e, attempt, deadline, breaker, probe)
+                if delay is None:
+                    if self._is_degraded(e):
+                        raise self._unavailable(e, breaker) from e
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            self._after_success(breaker, probe)
+            try:
+                yield result
+            finally:
+                self._release()
+            return
+
+    def state(self, breaker=None):
+        with self._lock:
+            return self._state(self._breaker_locked(breaker))
+
+    def open_breakers(self):
+        """How many of this provider's breakers are open or half-open"""
+        with self._lock:
+            return sum(self._state(breaker) != CLOSED for breaker in self._breakers.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight, 'calls': self.calls, 'retries': self.retries,
+                'failures': self.failures, 'rejected': self.rejected, 'trips': self.trips,
+            }
+
+    def _breaker(self, key):
+        with self._lock:
+            return self._breaker_locked(key)
+
+    def _breaker_locked(self, key):
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = Breaker(key or self.name)
+        return breaker
+
+    def _state(self, breaker):
+        if breaker.state == OPEN and time.monotonic() >= breaker.opened_until:
+            return HALF_OPEN
+        return breaker.state
+
+    def _admit(self, breaker):
+        """Raise if the breaker is open; returns True if this call is the half-open probe"""
+        with self._lock:
+            if breaker.state == CLOSED:
+                return False
+            now = time.monotonic()
+            if now < breaker.opened_until or breaker.probing:
+                self.rejected += 1
+                wait = max(1, round(breaker.opened_until - now))
+                raise CircuitOpen(
+                    f"{self.name} is having problems right now, please try again in {wait}s", wait)
+            breaker.state = HALF_OPEN
+            breaker.probing = True
+            return True
+
+    def _unavailable(self, error, breaker):
+        with self._lock:
+            if breaker.state == OPEN:
+                wait = breaker.opened_until - time.monotonic()
+            else:
+                wait = retry_after_seconds(error) or self.base_delay * 2 ** self.max_retries
+        wait = max(1, round(wait))
+        return UpstreamUnavailable(f"{self.name} is having problems right now, please try again in {wait}s", wait)
+
+    def _acquire(self, deadline, breaker, probe):
+        if not self._slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            with self._lock:
+                self.rejected += 1
+                if probe:
+                    breaker.probing = False
+            raise UpstreamUnavailable(f"Too many requests to {self.name} in progress, please try again", 1)
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _after_success(self, breaker, probe):
+        with self._lock:
+            if probe:
+                breaker.state = CLOSED
+                breaker.probing = False
+                breaker.failures = 0
+            elif breaker.state == CLOSED:
+                breaker.failures = 0
+            # A call admitted before the trip succeeding doesn't close the
+            # breaker; only the half-open probe does
+
+    def _after_failure(self, error, attempt, deadline, breaker, probe):
+        """Seconds to wait before retrying, or None to give up"""
+        degraded = self._is_degraded(error)
+        retry_after = retry_after_seconds(error)
+        with self._lock:
+            self.failures += 1
+            if degraded:
+                breaker.failures += 1
+                if probe or breaker.failures >= self.failure_threshold:
+                    self._trip(breaker, retry_after)
+                    return None
+            elif probe:
+                # The provider answered, just not with success
+                breaker.probing = False
+                breaker.state = CLOSED
+                breaker.failures = 0
+            if not self._is_retryable(error) or attempt >= self.max_retries:
+                return None
+
+            backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            delay = max(backoff, retry_after or 0)
+            if time.monotonic() + delay >= deadline:
+                return None
+            self.retries += 1
+            return delay
+
+    def _trip(self, breaker, retry_after):
+        cooldown = max(self.cooldown, retry_after or 0)
+        if breaker.state != OPEN:
+            self.trips += 1
+            print(f"{self.name} circuit for {breaker.name} open for {cooldown:g}s")
+        breaker.state = OPEN
+        breaker.probing = False
+        breaker.opened_until = time.monotonic() + cooldown
+
+    def _is_retryable(self, error):
+        status = getattr(error, 'status_code', None)
+        if status is not None:
+            return status in RETRY_STATUSES or status >= 500
+        return isinstance(error, self.connection_errors) and not isinstance(error, self.timeout_errors)
+
+    def _is_degraded(self, error):
+        return self._is_retryable(error) or isinstance(error, self.timeout_errors)